@@ -134,6 +134,9 @@ def stop(context):
     app = adsk.core.Application.get()
     ui = app.userInterface
 
+    # the parser of the last merge holds the gcode & layers of the whole job
+    Handlers.release_last_parser()
+
     try:
         # Get all workspaces:
         allWorkspaces = ui.workspaces
@@ -0,0 +1,42 @@
+"""
+Times `create_additive_layers` with an increasing number of worker processes.
+
+Run from the repo root:
+    python -m benchmarks.additive_layers --layers 2000 --moves 500
+"""
+import argparse
+import os
+import time
+
+from src import utils
+from src.ASMBL_parser import create_additive_layers
+from .gcode_generators import synthetic_additive_gcode
+
+
+def time_create_layers(chunks, workers):
+    start = time.perf_counter()
+    layers = create_additive_layers(chunks, workers)
+    return time.perf_counter() - start, layers
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description='Additive layer creation scaling benchmark')
+    arg_parser.add_argument('--layers', type=int, default=2000)
+    arg_parser.add_argument('--moves', type=int, default=500, help='moves per layer')
+    arg_parser.add_argument('--max-workers', type=int, default=os.cpu_count())
+    args = arg_parser.parse_args()
+
+    gcode = utils.convert_relative(synthetic_additive_gcode(args.layers, args.moves))
+    chunks = gcode.split('; layer')
+    print('{} layers, {:.1f} MB, {} cpus'.format(args.layers, len(gcode) / 1e6, os.cpu_count()))
+
+    workers = 1
+    serial_time, serial_layers = time_create_layers(chunks, 1)
+    print('{:>8} {:>10} {:>8}'.format('workers', 'time (s)', 'speedup'))
+    while workers <= args.max_workers:
+        duration, layers = (serial_time, serial_layers) if workers == 1 else time_create_layers(chunks, workers)
+        # the parallel layers must match the serial ordering exactly
+        assert [(layer.name, layer.layer_height, layer.gcode) for layer in layers] == \
+            [(layer.name, layer.layer_height, layer.gcode) for layer in serial_layers]
+        print('{:>8} {:>10.3f} {:>8.2f}'.format(workers, duration, serial_time / duration))
+        workers *= 2
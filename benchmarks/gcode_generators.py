@@ -0,0 +1,62 @@
+"""
+Synthetic gcode in the formats the Parser reads, so the benchmarks don't need Fusion 360 to post-process an example.
+"""
+import random
+
+
+def synthetic_additive_gcode(layers, moves, tool_change_every=7, seed=0):
+    """
+    Absolute extrusion gcode like Simplify3D/Fusion 360 additive exports, with '; layer' markers,
+    M82 & G92 extruder resets, a tool change every `tool_change_every` layers and a park move at the end
+    """
+    rand = random.Random(seed)
+    lines = ['; synthetic additive gcode', '; Layer Count: {}'.format(layers),
+             'G21', 'G90', 'M82', 'T0', 'G92 E0']
+    tool = 0
+    extrusion = 0
+    for layer in range(1, layers + 1):
+        height = layer * 0.2
+        lines.append('; layer {} of {}, Z = {:.3f}'.format(layer, layers, height))
+        if tool_change_every and layer % tool_change_every == 0:
+            tool = 1 - tool
+            lines.append('T{}'.format(tool))
+            lines.append('G92 E0')
+            extrusion = 0
+        lines.append('G0 X{:.3f} Y{:.3f} Z{:.3f}'.format(rand.uniform(-50, 50), rand.uniform(-50, 50), height))
+        lines.append('G1 F1800')
+        for _ in range(moves):
+            extrusion += rand.uniform(0.01, 0.5)
+            lines.append('G1 X{:.3f} Y{:.3f} E{:.5f}'.format(rand.uniform(-50, 50), rand.uniform(-50, 50), extrusion))
+    lines += ['; layer end', 'M104 S0', 'T-1', '; move to park position', 'G0 X0 Y0 Z200']
+    return '\n'.join(lines) + '\n'
+
+
+def synthetic_cam_gcode(operations, passes, points, seed=0):
+    """
+    Subtractive gcode like the asmbl_cam.cps post processor, operations are separated by a blank line and start
+    with the operation name, strategy & tool, then each pass has '(type: ...)' markers for its segments.
+    Every third operation is non planar.
+    """
+    rand = random.Random(seed)
+    blocks = []
+    for operation in range(operations):
+        planar = operation % 3 != 2
+        lines = ['(Operation {})'.format(operation),
+                 '(strategy: {})'.format('contour2d' if planar else 'scallop'),
+                 'T{}'.format(operation % 2 + 2),
+                 'G0 X0.000 Y0.000 Z15.000']
+        for cutting_pass in range(passes):
+            height = 0.5 + cutting_pass * 0.6 + operation * 0.05
+            x, y = rand.uniform(-40, 40), rand.uniform(-40, 40)
+            # every move has X, Y & Z, the parsers before the columnar CAM storage needed all 3 words
+            lines += ['(type: rapid)', 'G0 X{:.3f} Y{:.3f} Z{:.3f}'.format(x, y, height + 5),
+                      '(type: plunge)', 'G1 X{:.3f} Y{:.3f} Z{:.3f} F300.0'.format(x, y, height),
+                      '(type: lead in)', 'G1 X{:.3f} Y{:.3f} Z{:.3f} F600.0'.format(x + 0.5, y + 0.5, height),
+                      '(type: cutting)']
+            for _ in range(points):
+                z = height if planar else height + rand.uniform(0, 1)
+                lines.append('G1 X{:.3f} Y{:.3f} Z{:.3f} F900.0'.format(rand.uniform(-40, 40), rand.uniform(-40, 40), z))
+            lines += ['(type: lead out)', 'G1 X{:.3f} Y{:.3f} Z{:.3f} F600.0'.format(x, y, height),
+                      '(type: rapid)', 'G0 X{:.3f} Y{:.3f} Z{:.3f}'.format(x, y, height + 5)]
+        blocks.append('\n'.join(lines))
+    return '\n\n'.join(blocks) + '\n'
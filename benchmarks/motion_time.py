@@ -0,0 +1,33 @@
+"""
+Times the motion time estimator on synthetic additive gcode.
+
+Run from the repo root:
+    python -m benchmarks.motion_time --moves 1000000
+"""
+import argparse
+import time
+
+from src import utils
+from src.motion_time import DEFAULT_LIMITS, estimate_move_times, motion_columns
+from .gcode_generators import synthetic_additive_gcode
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description='Motion time estimator benchmark')
+    arg_parser.add_argument('--moves', type=int, default=1000000)
+    arg_parser.add_argument('--moves-per-layer', type=int, default=1000)
+    args = arg_parser.parse_args()
+
+    layers = max(1, args.moves // args.moves_per_layer)
+    gcode = utils.convert_relative(synthetic_additive_gcode(layers, args.moves_per_layer))
+    lines = gcode.split('\n')
+
+    start = time.perf_counter()
+    columns = motion_columns(lines)
+    parsed = time.perf_counter()
+    move_times = estimate_move_times(columns, (0.0, 0.0, 0.0), DEFAULT_LIMITS)
+    estimated = time.perf_counter()
+
+    print('{} moves, estimated {:.1f} h'.format(len(move_times), sum(move_times) / 3600))
+    print('parse {:.3f} s, estimate {:.3f} s, total {:.3f} s'.format(
+        parsed - start, estimated - parsed, estimated - start))
@@ -0,0 +1,82 @@
+"""
+Times each stage of the Parser and the peak memory allocated during it, on synthetic gcode.
+
+Run from the repo root:
+    python -m benchmarks.stages --layers 500 --moves 500 --operations 30
+"""
+import argparse
+import os
+import tempfile
+
+from src.ASMBL_parser import Parser
+from src.stage_profiler import StageProfiler
+from .gcode_generators import synthetic_additive_gcode, synthetic_cam_gcode
+
+STAGES = ['load', 'convert', 'split_additive', 'split_subtractive', 'order', 'merge', 'emit']
+
+
+def time_stages(config, trace_memory=True, **parser_options):
+    """
+    Runs each stage of a Parser in order, returns the StageProfiler records by stage name
+    tracemalloc slows down allocation heavy stages, so the peak memory is None if `trace_memory` is False
+    """
+    profiler = StageProfiler(trace_memory)
+    parser = Parser(config, profiler=profiler, **parser_options)
+
+    for name in STAGES:
+        getattr(parser, name)()
+
+    if parser.streaming:
+        with profiler.measure('write'):
+            for _ in parser.emit():     # the merge happens while the chunks are consumed
+                pass
+    profiler.stop()
+
+    return profiler.stages
+
+
+def create_config(folder, additive_gcode, subtractive_gcode):
+    """ Writes the gcode to `folder` and returns a config to parse them """
+    paths = {}
+    for name, gcode in (('additive_gcode', additive_gcode), ('subtractive_gcode', subtractive_gcode)):
+        paths[name] = os.path.join(folder, name + '.gcode')
+        with open(paths[name], 'w') as gcode_file:
+            gcode_file.write(gcode)
+
+    return {
+        "InputFiles": paths,
+        "Printer": {"bed_centre_x": 0, "bed_centre_y": 0},
+        "PrintSettings": {"raft_height": 0},
+        "CamSettings": {"layer_overlap": 1, "layer_dropdown": 0},
+        "OutputSettings": {"filename": "benchmark"},
+    }
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description='Parser stage benchmark')
+    arg_parser.add_argument('--layers', type=int, default=500)
+    arg_parser.add_argument('--moves', type=int, default=500, help='moves per additive layer')
+    arg_parser.add_argument('--operations', type=int, default=30)
+    arg_parser.add_argument('--passes', type=int, default=20, help='cutting passes per CAM operation')
+    arg_parser.add_argument('--points', type=int, default=100, help='cutting moves per pass')
+    arg_parser.add_argument('--stream', action='store_true')
+    arg_parser.add_argument('--mmap', action='store_true')
+    arg_parser.add_argument('--workers', type=int, default=1)
+    arg_parser.add_argument('--no-memory', action='store_true', help='time the stages without tracing memory')
+    args = arg_parser.parse_args()
+
+    additive_gcode = synthetic_additive_gcode(args.layers, args.moves)
+    subtractive_gcode = synthetic_cam_gcode(args.operations, args.passes, args.points)
+    print('additive {:.1f} MB, subtractive {:.1f} MB'.format(len(additive_gcode) / 1e6, len(subtractive_gcode) / 1e6))
+
+    with tempfile.TemporaryDirectory() as folder:
+        config = create_config(folder, additive_gcode, subtractive_gcode)
+        del additive_gcode, subtractive_gcode
+        results = time_stages(config, not args.no_memory, streaming=args.stream, memory_map=args.mmap, workers=args.workers)
+
+    print('{:>18} {:>10} {:>10} {:>10} {:>10}'.format('stage', 'time (s)', 'cpu (s)', 'lines', 'peak (MB)'))
+    for name, record in results.items():
+        print('{:>18} {:>10.3f} {:>10.3f} {:>10} {:>10}'.format(
+            name, record['wall_time'], record['cpu_time'], record['lines'] or '-',
+            '-' if record['peak_memory'] is None else '{:.1f}'.format(record['peak_memory'] / 1e6)))
+    print('{:>18} {:>10.3f}'.format('total', sum(record['wall_time'] for record in results.values())))
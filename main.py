@@ -1,8 +1,12 @@
 from src.ASMBL_parser import Parser
 
 import json
+import sys
 import argparse
 import os
+import time
+from contextlib import nullcontext
+from datetime import timedelta
 
 
 def arg_parser_json(arg):
@@ -14,17 +18,100 @@ def arg_parser_json(arg):
         return json.load(open(arg, 'r'))  # return a dict from the json
 
 
+def print_time_estimate(layer_times):
+    """ Prints the estimated time of the additive & subtractive layers and the total """
+    additive = sum(layer['time'] for layer in layer_times if layer['kind'] == 'AdditiveGcodeLayer')
+    subtractive = sum(layer['time'] for layer in layer_times if layer['kind'] == 'CamGcodeLayer')
+    for name, seconds in (('additive', additive), ('subtractive', subtractive), ('total', additive + subtractive)):
+        print('{:>12}: {}'.format(name, timedelta(seconds=round(seconds))))
+
+
 if __name__ == "__main__":
+    if getattr(sys, 'frozen', False):
+        import multiprocessing
+        multiprocessing.freeze_support()    # required for worker processes in the pyinstaller exe
 
     arg_parser = argparse.ArgumentParser(description='ASMBL Code Creation Tool')
-    arg_parser.add_argument('--config', '-C', type=arg_parser_json, default='config.json',
-                            metavar='FILE', help='path to json config file')
+    arg_parser.add_argument('--config', '-C', type=arg_parser_json, default=None,
+                            metavar='FILE', help='path to json config file (default: config.json)')
+    arg_parser.add_argument('--stream', '-S', action='store_true',
+                            help='read the input files lazily and write the output while merging to reduce memory use')
+    arg_parser.add_argument('--mmap', '-M', action='store_true',
+                            help='memory map the input files while streaming, for inputs larger than the available memory')
+    arg_parser.add_argument('--workers', '-W', type=int, default=1, metavar='N',
+                            help='number of processes used to parse the subtractive gcode operations')
+    arg_parser.add_argument('--layer-workers', type=int, default=1, metavar='N',
+                            help='number of processes used to scan the additive layers')
+    arg_parser.add_argument('--cache', default=None, metavar='FOLDER',
+                            help='cache the parsed gcode in this folder so unchanged inputs are not parsed again')
+    arg_parser.add_argument('--profile', default=None, metavar='FILE',
+                            help='save the time and lines of each stage to a json report')
+    arg_parser.add_argument('--profile-memory', action='store_true',
+                            help='also trace the peak memory of each stage in the --profile report, this slows down the stages')
+    arg_parser.add_argument('--headless', '-H', action='store_true',
+                            help='do not open the output file with the default desktop application')
+    arg_parser.add_argument('--compress', '-Z', choices=['gzip', 'xz', 'zstd'], default=None,
+                            help='compress the output while it is written, zstd needs the zstandard package')
+    arg_parser.add_argument('--estimate', '-E', action='store_true',
+                            help='print the estimated printing & machining time of the merged gcode')
+    arg_parser.add_argument('--batch', '-B', default=None, metavar='PATH',
+                            help='merge every config in a folder of json configs, or listed in a manifest file, instead of --config')
+    arg_parser.add_argument('--jobs', '-J', type=int, default=None, metavar='N',
+                            help='number of batch jobs run at the same time (default: number of cpus)')
 
     args = arg_parser.parse_args()
 
+    if args.profile_memory and not args.profile:
+        arg_parser.error('--profile-memory needs --profile')
+
+    if args.batch:
+        if args.profile:
+            arg_parser.error('--profile can not be used with --batch')
+        if args.estimate:
+            arg_parser.error('--estimate can not be used with --batch')
+
+        from src import batch
+
+        config_paths = batch.find_configs(args.batch)
+        parser_options = {'streaming': args.stream, 'memory_map': args.mmap, 'workers': args.workers,
+                          'layer_workers': args.layer_workers}
+        output_options = {'compression': args.compress}
+
+        print('merging {} jobs...'.format(len(config_paths)))
+        start = time.perf_counter()
+        try:
+            results = batch.run_batch(config_paths, args.jobs, parser_options, args.cache, output_options)
+        except ValueError as error:
+            arg_parser.error(str(error))
+        batch.print_summary(results, time.perf_counter() - start)
+        sys.exit(1 if any(result['error'] for result in results) else 0)
+
+    if args.config is None:
+        args.config = arg_parser_json('config.json')
+
+    # optional features are imported only when used, to keep start up fast for small jobs
+    cache = None
+    if args.cache:
+        from src.parse_cache import ParseCache
+        cache = ParseCache(args.cache)
+    profiler = None
+    if args.profile:
+        from src.stage_profiler import StageProfiler
+        profiler = StageProfiler(trace_memory=args.profile_memory)
+
     print('parsing files...')
-    asmbl_parser = Parser(args.config)
+    asmbl_parser = Parser(args.config, streaming=args.stream, memory_map=args.mmap, workers=args.workers,
+                          layer_workers=args.layer_workers, cache=cache, profiler=profiler)
     print('saving output...')
-    asmbl_parser.create_output_file(asmbl_parser.merged_gcode_script)
+    # when streaming most of the merge happens while the output is written
+    with profiler.measure('write') if profiler else nullcontext():
+        asmbl_parser.create_output_file(open_output=not args.headless, compression=args.compress)
+
+    if args.estimate:
+        print_time_estimate(asmbl_parser.estimate_layer_times())
+
+    if profiler:
+        profiler.stop()
+        profiler.write_report(args.profile)
     print('complete')
     pass
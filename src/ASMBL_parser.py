@@ -1,156 +1,404 @@
-import sys
-import subprocess
 import os
-import re
-from math import (
-    inf,
-    ceil,
-    floor,
-)
+import heapq
+from bisect import bisect_right
+from functools import wraps
+from math import inf
 from . import utils
-from .additive_gcode import AdditiveGcodeLayer
+from .additive_gcode import AdditiveGcodeLayer, scan_layer_heights
 from .cam_gcode import (
-    CamGcodeLine,
+    CamGcodeLines,
     CamGcodeSegment,
     CamGcodeLayer,
 )
 
+SCRIPT_HEADER = '; ASMBL gcode created by https://github.com/AndyEveritt/ASMBL\n'
+
+
+def stage(method):
+    """ Memoizes a stage of the Parser in `Parser.stages`, so it is only computed once, and profiles it """
+    @wraps(method)
+    def wrapper(self):
+        if method.__name__ not in self.stages:
+            if self.profiler is None:
+                self.stages[method.__name__] = method(self)
+            else:
+                with self.profiler.measure(method.__name__):
+                    self.stages[method.__name__] = method(self)
+        return self.stages[method.__name__]
+    return wrapper
+
 
 class Parser:
     """ Main parsing class. """
 
-    def __init__(self, config, progress=None):
+    def __init__(self, config, progress=None, streaming=False, memory_map=False, workers=1, layer_workers=1, cache=None, profiler=None):
+        """
+        Nothing is parsed until a stage is requested, see `load`, `convert`, `split`, `order`, `merge` & `emit`.
+        Each stage runs the stages it depends on and is only computed once, until `update` is called.
+        """
         self.config = config
         self.progress = progress    # progress bar for Fusion add-in
-        self.offset = (config['Printer']['bed_centre_x'],
-                       config['Printer']['bed_centre_y'],
-
-                       config['PrintSettings']['raft_height'] - config['CamSettings']['layer_dropdown']
-                       )
+        self.offset = self.get_offset(config)
+        self.parsed_offset = None   # offset of the parsed CAM layers, set by `split_subtractive`
 
         self.last_additive_tool = None
         self.last_subtractive_tool = None
 
-        self.main()
+        # In streaming mode the input files are read lazily and `merged_gcode_chunks` is an
+        # iterator, so only one additive layer is held in memory at a time
+        self.streaming = streaming or memory_map
+        # Memory map the input files while streaming, the layers & operations are found by scanning the
+        # mapped files and each one is only decoded when it is needed
+        self.memory_map = memory_map
+        # Number of processes used to parse the CAM operations & to scan the additive layers,
+        # everything is parsed in this process if 1
+        self.workers = workers
+        self.layer_workers = layer_workers
+        # ParseCache used to skip parsing unchanged inputs, only used when merging in memory
+        self.cache = cache
+        # StageProfiler that records the time, lines & memory of each stage
+        self.profiler = profiler
+
+        # {'additive_gcode': (path, size, modified time)} & {'additive_gcode': gcode} of the last read input files,
+        # & {'additive_gcode': sha256} for the cache keys when there is a cache
+        self.input_stats = {}
+        self.input_gcode = {}
+        self.input_hashes = {}
+
+        # results of the stages that have been computed, by stage name
+        self.stages = {}
+
+    def get_offset(self, config):
+        return (config['Printer']['bed_centre_x'],
+                config['Printer']['bed_centre_y'],
+
+                config['PrintSettings']['raft_height'] - config['CamSettings']['layer_dropdown']
+                )
 
     def main(self):
-        progress = self.progress
+        """ Runs every stage, returns the merged gcode chunks """
+        return self.emit()
+
+    def update(self, config=None):
+        """
+        Forgets the stages that depend on the input files or config that have changed since they were computed.
+        Only the inputs that have changed are parsed again, the parsed layers of the others are reused.
+        """
+        if config is not None:
+            self.config = config
+            self.offset = self.get_offset(config)
+
+        if self.streaming or 'load' not in self.stages:
+            self.stages.clear()
+            return
+
+        self.update_progress('Checking for changed files')
+        additive_changed = self.read_input('additive_gcode')
+        subtractive_changed = self.read_input('subtractive_gcode')
+        # the CAM layers are only reused if they were parsed, with the same offset
+        if 'split_subtractive' not in self.stages or self.offset != self.parsed_offset:
+            subtractive_changed = True
+
+        gcode_add, gcode_sub = self.stages['load']
+        self.stages['load'] = (self.gcode_add if additive_changed else gcode_add), self.gcode_sub
+
+        if additive_changed:
+            self.forget('convert', 'split_additive')
+        else:
+            self.update_progress('Reusing additive gcode layers', steps=2)
 
-        print('Opening files...')
-        if progress:
-            progress.message = 'Opening files'
-            progress.progressValue += 1
+        if subtractive_changed:
+            self.forget('split_subtractive')
+        else:
+            self.update_progress('Reusing subtractive gcode layers')
+
+        # the layer overlap may have changed and the merge depends on both inputs
+        self.forget('order', 'merge', 'emit')
+
+    @property
+    def profile(self):
+        """ The StageProfiler records of the stages that have run, by stage name """
+        return self.profiler.stages if self.profiler is not None else {}
+
+    def count_lines(self, *texts):
+        """ Adds the lines of gcode in `texts` to the profile of the running stage """
+        if self.profiler is not None:
+            self.profiler.add_lines(sum(text.count('\n') for text in texts))
+
+    def iter_counted_lines(self, chunks):
+        for chunk in chunks:
+            self.count_lines(chunk)
+            yield chunk
+
+    def forget(self, *names):
+        for name in names:
+            self.stages.pop(name, None)
+
+    @stage
+    def load(self):
+        """ Reads the input files, returns the additive & subtractive gcode. Files are read as they are parsed when streaming """
+        if self.streaming:
+            return None
+
+        self.update_progress('Opening files')
         self.open_files(self.config)
+        self.count_lines(self.gcode_add, self.gcode_sub)
+        return self.gcode_add, self.gcode_sub
+
+    @stage
+    def convert(self):
+        """ Returns the additive gcode with relative extrusion. Each layer is converted as it is read when streaming """
+        if self.streaming:
+            return None
+
+        gcode_add, _ = self.load()
 
         # Fusion 360 currently only exports absolute extrusion gcode, this needs to be converted
         # This method will not convert gcode if it is already relative
-        print('Converting additive gcode to relative positioning...')
-        if progress:
-            progress.message = 'Converting additive gcode to relative positioning'
-            progress.progressValue += 1
-        self.gcode_add = utils.convert_relative(self.gcode_add)
-
-        print('Spliting additive gcode layers...')
-        if progress:
-            progress.message = 'Spliting additive gcode layers'
-            progress.progressValue += 1
-        self.gcode_add_layers = self.split_additive_layers(self.gcode_add)
-
-        print('Spliting subtractive gcode layers...')
-        if progress:
-            progress.message = 'Spliting subtractive gcode layers'
-            progress.progressValue += 1
-        operations = self.split_cam_operations(self.gcode_sub)
-
-        print('Ordering subtractive gcode layers...')
-        if progress:
-            progress.message = 'Ordering subtractive gcode layers'
-            progress.progressValue += 1
+        self.update_progress('Converting additive gcode to relative positioning')
+        self.gcode_add = utils.convert_relative(gcode_add)
+        self.count_lines(gcode_add)
+        return self.gcode_add
+
+    def split(self):
+        """ Returns the additive layers and the CAM layers of each operation """
+        return self.split_additive(), self.split_subtractive()
+
+    @stage
+    def split_additive(self):
+        """ Returns the additive layers, or None when streaming where only `additive_layer_heights` are kept """
+        if self.streaming:
+            # First pass only keeps the layer heights, the gcode is re-read when it is merged
+            self.update_progress('Scanning additive gcode layers')
+            self.additive_layer_heights = self.scan_additive_file()
+
+            if all(prev_height <= height for prev_height, height in
+                   zip(self.additive_layer_heights, self.additive_layer_heights[1:])):
+                return None
+
+            print('Additive layer heights are not increasing, falling back to in memory merging...')
+            self.streaming = False
+            self.stages.clear()
+
+        self.load()
+        cached_layers = self.load_cache('additive', 'additive_gcode')
+        if cached_layers is not None:
+            self.update_progress('Loaded additive gcode layers from cache', steps=2)
+            self.gcode_add_layers = cached_layers
+            self.additive_layer_heights = [layer.layer_height for layer in self.gcode_add_layers]
+            return self.gcode_add_layers
+
+        gcode_add = self.convert()
+
+        self.update_progress('Spliting additive gcode layers')
+        self.gcode_add_layers = self.split_additive_layers(gcode_add)
+        self.count_lines(gcode_add)
+        self.store_cache('additive', 'additive_gcode', self.gcode_add_layers)
+        return self.gcode_add_layers
+
+    @stage
+    def split_subtractive(self):
+        """ Returns the CAM layers of each operation """
+        self.parsed_offset = self.offset
+
+        if self.streaming:
+            self.update_progress('Spliting subtractive gcode layers')
+            cam_operations = self.read_cam_operations(self.iter_counted_lines(self.iter_cam_file()))
+        else:
+            _, gcode_sub = self.load()
+            # The lines are cached before the offset is applied, so changing the offset doesn't parse the file again
+            cam_operations = self.load_cache('subtractive', 'subtractive_gcode')
+            if cam_operations is not None:
+                self.update_progress('Loaded subtractive gcode lines from cache')
+            else:
+                self.update_progress('Spliting subtractive gcode layers')
+                cam_operations = self.read_cam_operations(gcode_sub.split('\n\n'))
+                self.count_lines(gcode_sub)
+                if self.cache is not None:
+                    cam_operations = list(cam_operations)
+                    self.store_cache('subtractive', 'subtractive_gcode', cam_operations)
+
+        self.operations = [self.layer_cam_operation(self.offset, *cam_operation) for cam_operation in cam_operations]
+        return self.operations
+
+    @stage
+    def order(self):
+        """ Returns the CAM layers in order of cutting height, each with the additive layer height it is merged after """
+        _, operations = self.split()
+
+        self.update_progress('Ordering subtractive gcode layers')
         self.cam_layers = self.order_cam_operations_by_layer(operations)
-
-        print('Merging gcode layers...')
-        if progress:
-            progress.message = 'Merging gcode layers'
-            progress.progressValue += 1
-        self.merged_gcode = self.merge_gcode_layers(self.gcode_add_layers, self.cam_layers)
-
-        print('Creating gcode script...')
-        if progress:
-            progress.message = 'Creating gcode script'
-            progress.progressValue += 1
-        self.create_gcode_script(self.merged_gcode)
+        return self.cam_layers
+
+    @stage
+    def merge(self):
+        """ Returns the additive & CAM layers in print order, lazily when streaming """
+        gcode_add_layers, _ = self.split()
+        cam_layers = self.order()
+
+        self.update_progress('Merging gcode layers')
+        if self.streaming:
+            # The merge happens while the output file is being written
+            self.merged_gcode = None
+            return self.iter_merged_gcode_layers(self.iter_additive_file(), cam_layers)
+
+        self.merged_gcode = self.merge_gcode_layers(gcode_add_layers, cam_layers)
+        return self.merged_gcode
+
+    @stage
+    def emit(self):
+        """ Returns the merged gcode chunks, an iterator that can only be consumed once when streaming """
+        merged_gcode = self.merge()
+
+        self.update_progress('Creating gcode script')
+        if self.streaming:
+            self.merged_gcode_chunks = self.iter_gcode_script(merged_gcode)
+        else:
+            self.create_gcode_script(merged_gcode)
+            self.count_lines(*self.merged_gcode_chunks)
+        return self.merged_gcode_chunks
+
+    def update_progress(self, message, steps=1):
+        """ Prints the current stage and updates the progress bar of the Fusion add-in """
+        print(message + '...')
+        if self.progress:
+            self.progress.message = message
+            self.progress.progressValue += steps
+
+    def load_cache(self, name, input_name, *settings):
+        """ Returns the cached parse of an input file, or None if there is no cache or it isn't cached """
+        if self.cache is None:
+            return None
+        return self.cache.load(self.cache.get_key(self.input_hashes[input_name], name, *settings))
+
+    def store_cache(self, name, input_name, parsed, *settings):
+        if self.cache is not None:
+            self.cache.store(self.cache.get_key(self.input_hashes[input_name], name, *settings), parsed)
 
     def open_files(self, config):
         """ Open the additive and subtractive gcode files in `config` """
-        gcode_add_file = open(config['InputFiles']['additive_gcode'], 'r')
-        self.gcode_add = gcode_add_file.read()
+        self.config = config
+        self.input_stats = {}
+        self.input_gcode = {}
+        self.input_hashes = {}
+        self.read_input('additive_gcode')
+        self.read_input('subtractive_gcode')
 
-        gcode_sub_file = open(config['InputFiles']['subtractive_gcode'], 'r')
-        self.gcode_sub = gcode_sub_file.read()
+    def read_input(self, name):
+        """
+        Reads an input file of the config into `gcode_add` or `gcode_sub` if it has changed since it was last read.
+        Returns True if the gcode has changed, a file that was re-saved with the same gcode is not a change.
+        The gcode is only hashed for the cache keys, a file that was read before is compared with its previous gcode
+        """
+        path = self.config['InputFiles'][name]
+        stat = os.stat(path)
+        input_stat = (path, stat.st_size, stat.st_mtime_ns)
+        if self.input_stats.get(name) == input_stat:
+            return False
+
+        with open(path, 'r') as gcode_file:
+            gcode = gcode_file.read()
+        self.input_stats[name] = input_stat
+        if self.cache is not None:
+            self.input_hashes[name] = utils.hash_gcode(gcode)
+
+        if self.input_gcode.get(name) == gcode:
+            return False
+        self.input_gcode[name] = gcode
+
+        if name == 'additive_gcode':
+            self.gcode_add = gcode
+        else:
+            self.gcode_sub = gcode
+        return True
 
     def split_additive_layers(self, gcode_add):
         """ Takes Simplify3D gcode and splits in by layer """
-        tmp_list = re.split('(; layer)', gcode_add)
+        gcode_add_layers = create_additive_layers(gcode_add.split('; layer'), self.layer_workers)
+        self.set_last_additive_tool(gcode_add_layers[0])
+        self.additive_layer_heights = [layer.layer_height for layer in gcode_add_layers]
 
-        gcode_add_layers = []
+        return gcode_add_layers
+
+    def scan_additive_file(self):
+        """ Returns the additive layer heights from the raw lines of the file, without converting or splitting it """
+        with open(self.config['InputFiles']['additive_gcode'], 'r') as gcode_add_file:
+            lines = utils.iter_lines(self.iter_counted_lines(gcode_add_file))
+            return scan_layer_heights(lines)
+
+    def iter_additive_file(self):
+        """ Lazily reads, converts to relative extrusion, and splits the additive gcode file by layer """
+        if self.memory_map:
+            from .mapped_gcode import MappedGcodeFile    # deferred, like the other optional features
+            with MappedGcodeFile(self.config['InputFiles']['additive_gcode']) as gcode_add_file:
+                # each layer is converted separately, `state` carries the extrusion values between them
+                state = {}
+                chunks = (utils.convert_relative(gcode_add_file.read(start, stop), state)
+                          for start, stop in gcode_add_file.split('; layer'))
+                yield from self.iter_additive_layers(chunks)
+            return
+
+        with open(self.config['InputFiles']['additive_gcode'], 'r') as gcode_add_file:
+            lines = utils.iter_relative(utils.iter_lines(gcode_add_file))
+            chunks = utils.iter_split((line + '\n' for line in lines), '; layer')
+            yield from self.iter_additive_layers(chunks)
+
+    def iter_additive_layers(self, chunks):
+        """
+        Lazily creates an AdditiveGcodeLayer for each chunk of Simplify3D gcode that was split on '; layer'
+        The first chunk is the initialise layer and the last chunk is the end of the file.
+        """
+        chunks = iter(chunks)
         initialise_layer = AdditiveGcodeLayer(
-            tmp_list.pop(0),
+            next(chunks),
             name="initialise",
             layer_height=0,
         )    # slicer settings & initialise
         self.set_last_additive_tool(initialise_layer)
         # initialise_layer.comment_all_gcode()
-        gcode_add_layers.append(initialise_layer)
-
-        for i in range(ceil(len(tmp_list)/2)):
-
-            layer = tmp_list[2*i] + tmp_list[2*i+1]
-            name = layer.split(',')[0][2:]
-
-            if 2*i + 1 == len(tmp_list) - 1:
-                gcode_add_layers.append(AdditiveGcodeLayer(
-                    layer, 'end', inf))
-                continue
-
-            gcode_add_layers.append(AdditiveGcodeLayer(layer, name))
-
-        return gcode_add_layers
-
-    def assign_cam_line_type(self, unlabelled_lines):
-        """ extract type information from string, returns a list of CamGcodeLine's """
-        lines = []
-        line_type = None
-        for line in unlabelled_lines:
-            if line.startswith('(type: '):
-                line_type = line[7:].strip(')')
-            elif line.startswith('('):
-                continue
-            else:
-                lines.append(CamGcodeLine(line, self.offset, line_type))
-
-        return lines
-
-    def group_cam_lines(self, lines):
+        yield initialise_layer
+
+        chunk = next(chunks, None)
+        for next_chunk in chunks:
+            yield create_additive_layer('; layer' + chunk)
+            chunk = next_chunk
+
+        if chunk is not None:
+            yield AdditiveGcodeLayer('; layer' + chunk, 'end', inf)
+
+    @staticmethod
+    def assign_cam_line_type(unlabelled_lines):
+        """ extract type information from string, returns the lines as CamGcodeLines columns """
+        def labelled_lines():
+            line_type = None
+            for line in unlabelled_lines:
+                if line.startswith('(type: '):
+                    line_type = line[7:].strip(')')
+                elif line.startswith('('):
+                    continue
+                else:
+                    yield line, line_type
+
+        return CamGcodeLines.from_lines(labelled_lines())
+
+    @staticmethod
+    def group_cam_lines(lines):
         """
         Group consequetive lines of the same type into segments
         Returns a list of segments
         """
-        segments = []
-        segment_lines = [lines[0]]
-        for i, line in enumerate(lines[1:]):
-            if line.type != lines[i].type:
-                segment_index = len(segments)
-                segments.append(CamGcodeSegment(segment_index, segment_lines, lines[i].type))
-                segment_lines = [line]
-            else:
-                segment_lines.append(line)
+        if len(lines) == 0:
+            raise IndexError('CAM operation has no gcode lines')
 
-        segment_index = len(segments)
-        segments.append(CamGcodeSegment(segment_index, segment_lines, lines[-1].type))
+        segments = []
+        for line_type, segment_lines in lines.iter_runs():
+            segment_index = len(segments)
+            segments.append(CamGcodeSegment(segment_index, segment_lines, line_type))
 
         return segments
 
-    def add_lead_in_out(self, segments, cutting_group):
+    @staticmethod
+    def add_lead_in_out(segments, cutting_group):
         """
         Add lead in to start of group of cutting segments, and lead out to end if they exist.
         This is required to ensure the cutter does not miss any stock for certain toolpaths
@@ -171,7 +419,8 @@ class Parser:
 
         return segments[start_index:end_index+1]
 
-    def group_cam_segments(self, segments, name, strategy, tool):
+    @staticmethod
+    def group_cam_segments(segments, name, strategy, tool):
         """
         Group all cutting segments with a continuous and equal cutting height, including all intermediary segments.
         Lead-ins and lead-outs will be added to the start and end respectively if they exist.
@@ -191,55 +440,85 @@ class Parser:
             else:
                 cutting_height = cutting_segment.height
 
-                layer_group = self.add_lead_in_out(segments, cutting_group)
+                layer_group = Parser.add_lead_in_out(segments, cutting_group)
                 cam_layers.append(CamGcodeLayer(layer_group, name, strategy, tool))
                 cutting_group = [cutting_segment]
 
-        layer_group = self.add_lead_in_out(segments, cutting_group)
+        layer_group = Parser.add_lead_in_out(segments, cutting_group)
         cam_layers.append(CamGcodeLayer(layer_group, name, strategy, tool))
 
         return cam_layers
 
-    def split_cam_operations(self, gcode_sub):
-        """ Takes fusion360 CAM gcode and splits the operations by execution height """
-        tmp_operation_list = gcode_sub.split('\n\n')
-
-        operations = []
-
-        for i, operation in enumerate(tmp_operation_list):
-            unlabelled_lines = operation.split('\n')
-            name = unlabelled_lines.pop(0)
-            strategy = unlabelled_lines.pop(0)[11:].strip(')')
-            tool = unlabelled_lines.pop(0)
-            unlabelled_lines = [line for line in unlabelled_lines if line != '']
+    def read_cam_operations(self, operations):
+        """
+        Reads the lines of each CAM operation, see `read_cam_operation`. The operations are independent so if
+        `workers` is more than 1 they are read in a pool of processes, the results are in the same order as `operations`
+        """
+        return utils.map_processes(Parser.read_cam_operation, operations, self.workers)
+
+    def iter_cam_file(self):
+        """ Lazily reads the subtractive gcode file and splits it into operations """
+        if self.memory_map:
+            from .mapped_gcode import MappedGcodeFile
+            with MappedGcodeFile(self.config['InputFiles']['subtractive_gcode']) as gcode_sub_file:
+                for start, stop in gcode_sub_file.split('\n\n'):
+                    yield gcode_sub_file.read(start, stop)
+            return
+
+        with open(self.config['InputFiles']['subtractive_gcode'], 'r') as gcode_sub_file:
+            yield from utils.iter_split(gcode_sub_file, '\n\n')
+
+    @staticmethod
+    def read_cam_operation(operation):
+        """
+        Returns the name, strategy, tool & lines of the fusion360 CAM gcode of a single operation, the lines are
+        not offset yet. Only depends on `operation`, so it can run in a worker process
+        """
+        unlabelled_lines = operation.split('\n')
+        name = unlabelled_lines.pop(0)
+        strategy = unlabelled_lines.pop(0)[11:].strip(')')
+        tool = unlabelled_lines.pop(0)
+        unlabelled_lines = [line for line in unlabelled_lines if line != '']
 
-            lines = self.assign_cam_line_type(unlabelled_lines)
-            segments = self.group_cam_lines(lines)
-            operation_layers = self.group_cam_segments(segments, name, strategy, tool)
-            operations.append(operation_layers)
+        return name, strategy, tool, Parser.assign_cam_line_type(unlabelled_lines)
 
-        return operations
+    @staticmethod
+    def layer_cam_operation(offset, name, strategy, tool, lines):
+        """ Offsets the lines of a CAM operation read by `read_cam_operation` and splits them by execution height """
+        lines.apply_offset(offset)
+        segments = Parser.group_cam_lines(lines)
+        operation_layers = Parser.group_cam_segments(segments, name, strategy, tool)
 
-    def assign_cam_layer_height(self, cam_layer, later_cam_layers, layer_overlap):
-        """ Calculate the additive layer height that should be printed to before the CAM layer happens """
-        later_planar_layers = [layer for layer in later_cam_layers if layer.planar]
+        return operation_layers
 
-        if (not cam_layer.planar) or (len(later_planar_layers) == 0):
+    def assign_cam_layer_height(self, cam_layer, later_planar_height, layer_overlap):
+        """
+        Calculate the additive layer height that should be printed to before the CAM layer happens
+        `later_planar_height` is the lowest cutting height of the planar CAM layers above `cam_layer`, or None
+        """
+        if (not cam_layer.planar) or (later_planar_height is None):
             cutting_height = cam_layer.cutting_height
         else:
-            cutting_height = min([layer.cutting_height for layer in later_planar_layers])
+            cutting_height = later_planar_height
 
-        later_additive = [layer for layer in self.gcode_add_layers[:-1]
-                          if layer.layer_height > cutting_height]
+        if self.additive_heights_increasing:
+            later_start = bisect_right(self.additive_heights, cutting_height)
+            later_additive = self.additive_heights
+        else:
+            # bisect needs increasing heights, fall back to filtering every layer in print order
+            later_start = 0
+            later_additive = [layer_height for layer_height in self.additive_heights
+                              if layer_height > cutting_height]
+        later_count = len(later_additive) - later_start
 
-        if (layer_overlap == 0) or (len(later_additive) == 0):
+        if (layer_overlap == 0) or (later_count == 0):
             cam_layer_height = cutting_height
 
-        elif len(later_additive) >= layer_overlap:
-            cam_layer_height = later_additive[layer_overlap - 1].layer_height
+        elif later_count >= layer_overlap:
+            cam_layer_height = later_additive[later_start + layer_overlap - 1]
 
         else:
-            cam_layer_height = later_additive[-1].layer_height
+            cam_layer_height = later_additive[-1]
 
         if cam_layer_height == inf:
             raise ValueError("CAM op height can't be 'inf'")
@@ -259,12 +538,25 @@ class Parser:
 
         layer_overlap = self.config['CamSettings']['layer_overlap']
 
+        # heights of the additive layers, excluding the end of the file
+        self.additive_heights = self.additive_layer_heights[:-1]
+        self.additive_heights_increasing = all(
+            prev_height <= height for prev_height, height in zip(self.additive_heights, self.additive_heights[1:]))
+
+        # The layers are sorted, so the lowest planar cutting height from each index onwards is the first planar layer
+        cutting_heights = [cam_layer.cutting_height for cam_layer in ordered_cam_layers]
+        next_planar_heights = [None] * (len(ordered_cam_layers) + 1)
+        for i in reversed(range(len(ordered_cam_layers))):
+            if ordered_cam_layers[i].planar:
+                next_planar_heights[i] = cutting_heights[i]
+            else:
+                next_planar_heights[i] = next_planar_heights[i + 1]
+
         # TODO assign layer height per layer in each operation independently.
         # There is an issue if you have sparse CAM currently
         for i, cam_layer in enumerate(ordered_cam_layers):
-            later_cam_layers = [
-                layer for layer in ordered_cam_layers if layer.cutting_height > cam_layer.cutting_height]
-            self.assign_cam_layer_height(cam_layer, later_cam_layers, layer_overlap)
+            later_start = bisect_right(cutting_heights, cam_layer.cutting_height)
+            self.assign_cam_layer_height(cam_layer, next_planar_heights[later_start], layer_overlap)
 
         return ordered_cam_layers
 
@@ -273,14 +565,15 @@ class Parser:
         Adds redamentary retracts between cam layers.
         Required since some of the retracts are removed by `group_cam_segments`
         """
-        first_line = cam_layer.segments[0].lines[0]
-        last_line = cam_layer.segments[-1].lines[-1]
+        first_line = cam_layer.segments[0].lines.get_line(0)
+        last_line = cam_layer.segments[-1].lines.get_line(-1)
 
         offset = (0, 0, clearance_height)
-        pre_retract = utils.offset_gcode(first_line.gcode, offset)
-        post_retract = utils.offset_gcode(last_line.gcode, offset)
+        pre_retract = utils.offset_gcode(first_line, offset)
+        post_retract = utils.offset_gcode(last_line, offset)
 
-        cam_layer.gcode = '; retract\n' + pre_retract + '\n' + cam_layer.gcode + '; retract\n' + post_retract + '\n'
+        cam_layer.pre_gcode = '; retract\n' + pre_retract + '\n'
+        cam_layer.post_gcode = '; retract\n' + post_retract + '\n'
 
     def merge_gcode_layers(self, gcode_add, cam_layers):
         """ Takes the individual CAM instructions and merges them into the additive file from Simplify3D """
@@ -292,50 +585,222 @@ class Parser:
 
         return merged_gcode
 
+    def iter_merged_gcode_layers(self, gcode_add, cam_layers):
+        """
+        Lazy version of `merge_gcode_layers`.
+        `gcode_add` is an iterable of additive layers that must already be in order of layer height.
+        """
+        for cam_layer in cam_layers:
+            self.add_retracts(cam_layer)
+
+        # the merge is stable so additive layers go before CAM layers of equal height, same as the sort
+        cam_layers = sorted(cam_layers, key=lambda x: x.layer_height)
+        return heapq.merge(gcode_add, cam_layers, key=lambda x: x.layer_height)
+
     def create_gcode_script(self, gcode):
-        """ Converts list of layers into a single string with appropriate tool changes """
-        self.merged_gcode_script = '; ASMBL gcode created by https://github.com/AndyEveritt/ASMBL\n'
-        prev_layer = gcode[0]
+        """
+        Converts list of layers into a list of gcode chunks with appropriate tool changes
+        The chunks reference the gcode of each layer, so the full script is never copied into one string
+        """
+        self.merged_gcode_chunks = list(self.iter_gcode_script(gcode))
+
+    @property
+    def merged_gcode_script(self):
+        """ The merged gcode as a single string. In streaming mode this consumes `merged_gcode_chunks` """
+        return ''.join(self.emit())
+
+    def iter_gcode_script(self, gcode):
+        """ Lazily converts an iterable of layers into chunks of gcode with appropriate tool changes """
+        yield SCRIPT_HEADER
+        for _, _, chunks in self.iter_script_layers(gcode):
+            yield from chunks
+
+    def iter_script_layers(self, gcode):
+        """
+        Lazily converts an iterable of layers into (layer, tool, gcode chunks) with the tool change before each layer.
+        `tool` is the tool in use at the start of the layer, or None if it isn't known yet
+        """
+        self.last_additive_tool = None
+        prev_layer = None
         for layer in gcode:
+            if prev_layer is None:
+                prev_layer = layer
             self.set_last_additive_tool(prev_layer)
-            self.tool_change(layer, prev_layer)
+            chunks = [self.tool_change(layer, prev_layer)] + layer.get_gcode_chunks()
             prev_layer = layer
-            self.merged_gcode_script += layer.gcode
+            yield layer, self.get_layer_tool(layer), chunks
+
+    def get_layer_tool(self, layer):
+        """ Returns the tool in use at the start of a layer """
+        if type(layer) == CamGcodeLayer:
+            return layer.tool
+        if layer.first_gcode.startswith('T'):
+            return layer.first_gcode.split()[0]
+        return self.last_additive_tool
+
+    def write_script_layers(self, f):
+        """
+        Writes the merged gcode script to `f` a layer at a time, returns the index records of the layers.
+        The offsets come from `f.tell()`, so they are byte offsets in the file whatever the newline translation
+        """
+        records = [{'name': 'header', 'kind': 'header', 'layer_height': 0, 'tool': None, 'offset': f.tell()}]
+        f.write(SCRIPT_HEADER)
+        for layer, tool, chunks in self.iter_script_layers(self.merge()):
+            records.append({
+                'name': layer.name,
+                'kind': type(layer).__name__,
+                'layer_height': utils.json_height(layer.layer_height),
+                'tool': tool,
+                'offset': f.tell(),
+            })
+            f.writelines(chunks)
+
+        end = f.tell()
+        for record, next_record in zip(records, records[1:] + [{'offset': end}]):
+            record['length'] = next_record['offset'] - record['offset']
+
+        return records
+
+    def estimate_layer_times(self, limits=None):
+        """
+        Estimates the seconds to run each merged layer, returns a list of dicts of each layer's name, kind,
+        layer_height, tool & time. `limits` overrides the acceleration & feedrate limits of the optional
+        'MotionSettings' in the config, see `motion_time.DEFAULT_LIMITS`
+        """
+        from .motion_time import estimate_time    # deferred, only used when estimating
+
+        limits = dict(self.config.get('MotionSettings', {}), **(limits or {}))
+        if self.streaming:
+            self.forget('merge', 'emit')    # the merge is an iterator that may have been consumed already
+
+        state = {}      # position & feedrate carry over between layers
+        layer_times = []
+        for layer, tool, chunks in self.iter_script_layers(self.merge()):
+            layer_times.append({
+                'name': layer.name,
+                'kind': type(layer).__name__,
+                'layer_height': utils.json_height(layer.layer_height),
+                'tool': tool,
+                'time': estimate_time(''.join(chunks).split('\n'), state, limits),
+            })
+
+        if self.streaming:
+            self.forget('merge', 'emit')
+        return layer_times
+
+    def create_layer_file(self, file_path, compression='zlib'):
+        """
+        Saves the merged layers to a binary layer file that can be read back with `LayerFileReader`, one compressed
+        block per layer so any layer can be read without the rest. The first block is the script header.
+        In streaming mode this consumes the merge, so use it instead of `emit`
+        """
+        from .layer_file import LayerFileWriter    # deferred, only used for binary layer files
+
+        file_path = os.path.expanduser(file_path)
+        with LayerFileWriter(file_path, compression) as writer:
+            writer.write_layer(SCRIPT_HEADER, 'header', 'header')
+            for layer, tool, chunks in self.iter_script_layers(self.merge()):
+                writer.write_layer(''.join(chunks), layer.name, type(layer).__name__, layer.layer_height, tool)
+
+        return file_path
 
     def set_last_additive_tool(self, layer):
         """ Finds the last used tool in a layer and saves it in memory """
         if isinstance(layer, AdditiveGcodeLayer):
-            process_list = layer.gcode.split('\nT')
-            if len(process_list) > 1:
-                self.last_additive_tool = 'T' + process_list[-1].split('\n')[0]
+            if layer.last_tool is not None:
+                self.last_additive_tool = layer.last_tool
 
     def tool_change(self, layer, prev_layer):
-        """ Adds any required tool changes between 2 layers """
+        """ Returns any required tool changes between 2 layers """
         if type(layer) == AdditiveGcodeLayer:
             if layer.name == 'initialise' or prev_layer.name == 'initialise':
-                return  # no need to add a tool change
-            first_gcode = layer.gcode.split('\n')[1]
-            if first_gcode[0] != 'T':
-                self.merged_gcode_script += self.last_additive_tool + '\n'
+                return ''  # no need to add a tool change
+            if not layer.first_gcode.startswith('T'):
+                return self.last_additive_tool + '\n'
         elif type(layer) == CamGcodeLayer:
-            self.merged_gcode_script += layer.tool + '\n'
+            return layer.tool + '\n'
+        return ''
 
-    def create_output_file(self, gcode, folder_path="output/", relative_path=True):
-        """ Saves the file to the output folder """
+    def create_output_file(self, gcode=None, folder_path="output/", relative_path=True, open_output=True, index=True,
+                           compression=None):
+        """
+        Saves the file to the output folder and returns its path
+        `gcode` can be a string or an iterable of gcode chunks, e.g. `merged_gcode_chunks`, which are
+        written to the buffered file as they are generated.
+        If `gcode` is None the merged layers are written, along with a layer index sidecar if `index` is True,
+        see `layer_index.IndexedGcodeReader`. In streaming mode this consumes the merge, so use it instead of `emit`
+        `compression` is one of 'gzip', 'xz' or 'zstd' to compress the output while it is written, the extension
+        is added to the file name
+        The file is opened with the desktop's default application unless `open_output` is False, e.g. when headless
+        """
         file_path = folder_path + self.config['OutputSettings']['filename'] + ".gcode"
+        if compression is not None:
+            from .compressed_output import CompressedWriter, EXTENSIONS    # deferred, only used when compressing
+            file_path += EXTENSIONS[compression]
 
         file_path = os.path.expanduser(file_path)
         os.makedirs(os.path.dirname(file_path), exist_ok=True)
 
-        with open(file_path, "w") as f:
-            f.write(gcode)
+        if compression is None:
+            output_file = open(file_path, "w")
+        else:
+            output_file = CompressedWriter(file_path, compression)
+
+        with output_file as f:
+            if gcode is None:
+                records = self.write_script_layers(f)
+            elif isinstance(gcode, str):
+                f.write(gcode)
+            else:
+                f.writelines(gcode)
 
         f.close()
 
-        try:
-            utils.open_file(file_path)
-        except FileNotFoundError:
-            pass
+        if gcode is None and index:
+            from .layer_index import write_index    # deferred, the index is written after the output is closed
+            write_index(file_path, records)
+
+        if open_output and compression is None:   # there is no point opening a compressed file in an editor
+            try:
+                utils.open_file(file_path)
+            except FileNotFoundError:
+                pass
+
+        return file_path
+
+
+def create_additive_layer(layer):
+    """ Creates an AdditiveGcodeLayer from a '; layer' chunk """
+    name = layer.split(',')[0][2:]
+    return AdditiveGcodeLayer(layer, name)
+
+
+def scan_additive_layer(layer):
+    """ Scans a '; layer' chunk in a worker process of `create_additive_layers`, only the metadata is returned """
+    return create_additive_layer(layer).metadata()
+
+
+def create_additive_layers(chunks, workers=1):
+    """
+    Creates the AdditiveGcodeLayer's of a list of chunks of Simplify3D gcode split on '; layer', see
+    `Parser.iter_additive_layers`. The layers are independent, so if `workers` is more than 1 the layers between the
+    first and last chunk are scanned in a pool of processes. Only the metadata of each layer is sent back, the layers
+    are created here from their gcode. The layers are always in the same order as `chunks`
+    """
+    gcode_add_layers = [AdditiveGcodeLayer(chunks[0], name="initialise", layer_height=0)]
+    if len(chunks) == 1:
+        return gcode_add_layers
+
+    layers = ['; layer' + chunk for chunk in chunks[1:-1]]
+    if workers <= 1:
+        gcode_add_layers.extend(map(create_additive_layer, layers))
+    else:
+        chunksize = max(1, len(layers) // (workers * 4))
+        metadata = utils.map_processes(scan_additive_layer, layers, workers, chunksize)
+        gcode_add_layers.extend(map(AdditiveGcodeLayer.from_metadata, layers, metadata))
+    gcode_add_layers.append(AdditiveGcodeLayer('; layer' + chunks[-1], 'end', inf))
+
+    return gcode_add_layers
 
 
 if __name__ == "__main__":
@@ -1,4 +1,9 @@
 from math import inf
+from .gcode_tokenizer import tokenize
+
+
+# Fusion adds some dirty end gcode after this comment
+PARK_MARKER = '; move to park position'
 
 
 class AdditiveGcodeLayer:
@@ -10,39 +15,59 @@ class AdditiveGcodeLayer:
         self.layer_height = layer_height
 
         self.remove_park_gcode()
+        self.scan_gcode()
 
         if name is None:
             self.name = self.get_name(self.gcode)
 
         if layer_height is None:
-            self.layer_height = self.get_layer_height(self.gcode)
+            self.layer_height = self.get_layer_height()
+
+    @classmethod
+    def from_metadata(cls, gcode, metadata):
+        """ Creates the layer from its gcode & the `metadata` of a layer that was already scanned, without scanning it again """
+        layer = cls.__new__(cls)
+        layer.name, layer.layer_height, layer.first_gcode, layer.last_tool, layer.min_z, layer.park_position = metadata
+        layer.gcode = gcode if layer.park_position is None else gcode[:layer.park_position]
+        return layer
+
+    def metadata(self):
+        """ Everything but the gcode, this is all that is sent back from the worker processes """
+        return self.name, self.layer_height, self.first_gcode, self.last_tool, self.min_z, self.park_position
 
     def get_name(self, gcode):
         return gcode.split(',')[0][2:]
 
-    def get_layer_height(self, gcode):
-        height = None
-        lines = gcode.split('\n')
+    def scan_gcode(self):
+        """
+        Caches the metadata used while merging in a single pass over the lines of the layer:
+        the first command after the layer comment, the last tool selected, and the lowest Z height
+        """
+        lines = self.gcode.split('\n')
+        self.first_gcode = lines[1] if len(lines) > 1 else ''
+        self.last_tool = None
+        self.min_z = None
 
-        # Check for Simplify3D end of file code
-        if lines[0] == '; layer end':
-            height = inf
+        for i, line in enumerate(lines):
+            if line == '':
+                continue
+            if line[0] == ';':
+                continue
+            if line[0] == 'T':
+                if i > 0:
+                    self.last_tool = line
+                continue
+            if 'Z' in line:
+                line_height = tokenize(line).z
+                if line_height is not None and (self.min_z is None or line_height < self.min_z):
+                    self.min_z = line_height
 
-        else:
-            line_heights = []
-            for line in lines:
-                if line == '':
-                    continue
-                if line[0] == ';':
-                    continue
-                line_segments = line.split('Z')
-                if len(line_segments) > 1:
-                    line_height = float(line_segments[1].split(' ')[0])
-                    line_heights.append(line_height)
+    def get_layer_height(self):
+        return get_layer_height(self.gcode.partition('\n')[0], self.min_z)
 
-            height = min(line_heights)
-
-        return height
+    def get_gcode_chunks(self):
+        """ Returns the complete gcode of the layer as a list of strings """
+        return [self.gcode]
 
     def comment_all_gcode(self):
         commented_gcode = ''
@@ -53,8 +78,82 @@ class AdditiveGcodeLayer:
                     line = '; ' + line
                 commented_gcode += line + '\n'
         self.gcode = commented_gcode
+        self.scan_gcode()
 
     def remove_park_gcode(self):
         # Fusion adds some dirty end gcode
         # Kill it with fire until they let us control the end gcode with the post processor
-        self.gcode = self.gcode.split('; move to park position')[0]
+        self.park_position = self.gcode.find(PARK_MARKER)
+        if self.park_position < 0:
+            self.park_position = None
+        else:
+            self.gcode = self.gcode[:self.park_position]
+
+
+def scan_layer_heights(lines):
+    """
+    Returns the height of each layer of Simplify3D gcode, the same as `AdditiveGcodeLayer.layer_height`
+    of the initialise layer, each '; layer' and the end of the file.
+    Only the '; layer' comments and the Z words of the raw lines are read, the layers are not created
+    """
+    layer_heights = [0]     # initialise layer
+    layer = None
+    min_z = None
+    parked = False
+    for starts_layer, line in iter_layer_lines(lines):
+        if starts_layer:
+            if layer is not None:
+                layer_heights.append(get_layer_height(layer, min_z))
+            layer = line
+            min_z = None
+            parked = False
+        if layer is None or parked or line == '':
+            continue
+
+        # everything after the park marker is removed from the layer, see `AdditiveGcodeLayer.remove_park_gcode`
+        park_position = line.find(PARK_MARKER)
+        if park_position >= 0:
+            parked = True
+            line = line[:park_position]
+            if line == '':
+                continue
+
+        if line[0] == ';' or line[0] == 'T':
+            continue
+        if 'Z' in line:
+            line_height = tokenize(line).z
+            if line_height is not None and (min_z is None or line_height < min_z):
+                min_z = line_height
+
+    if layer is not None:
+        layer_heights.append(inf)   # end of the file
+
+    return layer_heights
+
+
+def iter_layer_lines(lines):
+    """
+    Yields (starts a layer, line) for each line, split wherever '; layer' is found like the gcode is split into layers,
+    so a '; layer' comment part way through a line starts a layer there
+    """
+    for line in lines:
+        if '; layer' not in line:
+            yield False, line
+            continue
+
+        pieces = line.split('; layer')
+        yield False, pieces[0]
+        for piece in pieces[1:]:
+            yield True, '; layer' + piece
+
+
+def get_layer_height(first_line, min_z):
+    """ Height of a layer from its '; layer' comment and the lowest Z height before the park gcode """
+    # Check for Simplify3D end of file code
+    if first_line == '; layer end':
+        return inf
+
+    if min_z is None:
+        raise ValueError('Additive layer has no Z height: {}'.format(first_line))
+
+    return min_z
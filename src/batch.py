@@ -0,0 +1,96 @@
+import glob
+import json
+import os
+import time
+import traceback
+from functools import partial
+
+from . import utils
+from .ASMBL_parser import Parser
+from .parse_cache import ParseCache
+
+
+def find_configs(path):
+    """
+    Returns the config files of a batch.
+    `path` is either a folder of .json configs, or a manifest listing one config path per line relative to the manifest
+    """
+    if os.path.isdir(path):
+        return sorted(glob.glob(os.path.join(path, '*.json')))
+
+    folder = os.path.dirname(path)
+    with open(path, 'r') as manifest:
+        lines = [line.strip() for line in manifest]
+    return [os.path.join(folder, line) for line in lines if line and not line.startswith('#')]
+
+
+def check_output_names(config_paths):
+    """
+    Raises ValueError if more than one config has the same `OutputSettings.filename`, the jobs would overwrite each other's output.
+    Configs that can't be read are skipped, their job reports the error
+    """
+    config_paths_by_name = {}
+    for config_path in config_paths:
+        try:
+            with open(config_path, 'r') as config_file:
+                filename = json.load(config_file)['OutputSettings']['filename']
+        except (OSError, ValueError, KeyError, TypeError):
+            continue
+        config_paths_by_name.setdefault(filename, []).append(config_path)
+
+    duplicates = ['{}: {}'.format(filename, ', '.join(paths))
+                  for filename, paths in config_paths_by_name.items() if len(paths) > 1]
+    if duplicates:
+        raise ValueError('Configs with the same output filename:\n' + '\n'.join(duplicates))
+
+
+def run_job(config_path, parser_options=None, cache_folder=None, output_options=None):
+    """
+    Merges the gcode of a single config and saves the output, used by the worker processes of `run_batch`
+    Returns a dict of the config path, output path, time taken and the traceback if the job failed
+    """
+    result = {'config': config_path, 'output': None, 'time': None, 'error': None}
+    start = time.perf_counter()
+    try:
+        with open(config_path, 'r') as config_file:
+            config = json.load(config_file)
+
+        cache = ParseCache(cache_folder) if cache_folder else None
+        asmbl_parser = Parser(config, cache=cache, **(parser_options or {}))
+        # jobs are always headless, opening every output would flood the desktop
+        result['output'] = asmbl_parser.create_output_file(open_output=False, **(output_options or {}))
+    except Exception:
+        result['error'] = traceback.format_exc()
+    result['time'] = time.perf_counter() - start
+
+    return result
+
+
+def run_batch(config_paths, jobs=None, parser_options=None, cache_folder=None, output_options=None):
+    """
+    Runs a job for each config in a pool of `jobs` processes, so the interpreter start up & imports are only paid once
+    per process. A failed job does not stop the others. Returns the results of `run_job` in the order of `config_paths`
+    Raises ValueError before any job is run if two configs have the same output filename
+    """
+    check_output_names(config_paths)
+
+    jobs = min(jobs or os.cpu_count() or 1, max(len(config_paths), 1))
+    job = partial(run_job, parser_options=parser_options, cache_folder=cache_folder, output_options=output_options)
+    return list(utils.map_processes(job, config_paths, jobs))
+
+
+def print_summary(results, total_time):
+    """ Prints a table of the time taken by each job """
+    name_width = max([len('config')] + [len(result['config']) for result in results])
+    print('{:<{width}} {:>8} {:>10}  {}'.format('config', 'status', 'time (s)', 'output', width=name_width))
+    for result in results:
+        status = 'failed' if result['error'] else 'ok'
+        print('{:<{width}} {:>8} {:>10.2f}  {}'.format(
+            result['config'], status, result['time'], result['output'] or '', width=name_width))
+
+    for result in results:
+        if result['error']:
+            print('\n{} failed:\n{}'.format(result['config'], result['error']))
+
+    failed = sum(1 for result in results if result['error'])
+    print('{} jobs, {} failed, {:.2f} s total'.format(len(results), failed, total_time))
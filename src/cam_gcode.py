@@ -1,18 +1,148 @@
-from math import inf
-from . import utils
-
-
-class CamGcodeLine:
-    """ Stores a single line of fusion360 CAM gcode. """
-
-    def __init__(self, gcode, offset, line_type):
-        self.gcode = utils.offset_gcode(gcode, offset)
-        self.layer_height = self.get_layer_height(self.gcode)
-        self.type = line_type
-
-    def get_layer_height(self, gcode):
-        """Return the layer height of single line of gcode."""
-        return float(gcode.split('Z')[1].split(' ')[0])
+from array import array
+from itertools import (
+    accumulate,
+    groupby,
+)
+from math import nan
+from .gcode_tokenizer import (
+    tokenize,
+    replace_xyz,
+)
+
+
+class CamGcodeLines:
+    """
+    Stores the lines of fusion360 CAM gcode in columns.
+    The gcode text of every line is kept in a single shared buffer, slicing returns a view that
+    shares the same columns so segments do not copy any lines.
+    """
+
+    def __init__(self, gcode, line_starts, x, y, z, words, types, type_names, start=0, stop=None):
+        self.gcode = gcode                  # text of all the lines, each ending with a newline
+        self.line_starts = line_starts      # offset of each line into `gcode`, plus the end offset
+        self.x = x
+        self.y = y
+        self.z = z
+        self.words = words                  # bit mask of the X (1), Y (2) & Z (4) words in each line
+        self.types = types                  # index into `type_names` for each line
+        self.type_names = type_names
+        self.start = start
+        self.stop = len(types) if stop is None else stop
+
+    @classmethod
+    def from_lines(cls, lines, offset=(0, 0, 0)):
+        """
+        Creates the columns from an iterable of (gcode, line_type) pairs, then offsets the XYZ positions.
+        Words that are missing from a line keep the position of the previous line.
+        """
+        texts = []
+        x = array('d')
+        y = array('d')
+        z = array('d')
+        words = array('B')
+        types = array('H')
+        type_names = []
+        type_codes = {}
+
+        position = [nan, nan, nan]
+        for gcode, line_type in lines:
+            tokens = tokenize(gcode)
+            texts.append(gcode)
+            line_words = 0
+            for axis, value in enumerate((tokens.x, tokens.y, tokens.z)):
+                if value is not None:
+                    position[axis] = value
+                    line_words |= 1 << axis
+            words.append(line_words)
+            x.append(position[0])
+            y.append(position[1])
+            z.append(position[2])
+
+            if line_type not in type_codes:
+                type_codes[line_type] = len(type_names)
+                type_names.append(line_type)
+            types.append(type_codes[line_type])
+
+        cam_lines = cls(cls.join_lines(texts), cls.get_line_starts(texts), x, y, z, words, types, type_names)
+        cam_lines.apply_offset(offset)
+
+        return cam_lines
+
+    @staticmethod
+    def join_lines(texts):
+        return '\n'.join(texts) + '\n' if texts else ''
+
+    @staticmethod
+    def get_line_starts(texts):
+        line_starts = array('Q', [0])
+        line_starts.extend(accumulate(len(text) + 1 for text in texts))
+        return line_starts
+
+    def apply_offset(self, offset):
+        """
+        Moves all the lines by `offset`, the columns are offset in bulk then the text is rewritten.
+        A zero offset leaves the columns and text untouched.
+        Applies to the whole buffer, so should be called before the lines are split into views.
+        """
+        if not any(offset):
+            return
+
+        for column, axis_offset in zip((self.x, self.y, self.z), offset):
+            if axis_offset:
+                column[:] = array('d', [value + axis_offset for value in column])
+
+        texts = []
+        for i in range(len(self.types)):
+            text = self.gcode[self.line_starts[i]:self.line_starts[i + 1] - 1]
+            line_words = self.words[i]
+            texts.append(replace_xyz(
+                text,
+                self.x[i] if line_words & 1 else None,
+                self.y[i] if line_words & 2 else None,
+                self.z[i] if line_words & 4 else None,
+            ))
+
+        self.gcode = self.join_lines(texts)
+        self.line_starts = self.get_line_starts(texts)
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getitem__(self, index):
+        """ Returns a view of a slice of the lines """
+        start, stop, _ = index.indices(len(self))
+        return CamGcodeLines(self.gcode, self.line_starts, self.x, self.y, self.z, self.words, self.types,
+                             self.type_names, self.start + start, self.start + max(start, stop))
+
+    def get_z_heights(self):
+        return self.z[self.start:self.stop]
+
+    def get_type(self, index):
+        return self.type_names[self.types[self._absolute_index(index)]]
+
+    def get_line(self, index):
+        """ Returns the gcode of a single line without the newline """
+        index = self._absolute_index(index)
+        return self.gcode[self.line_starts[index]:self.line_starts[index + 1] - 1]
+
+    def get_gcode(self):
+        """ Returns the gcode of all the lines in the view """
+        return self.gcode[self.line_starts[self.start]:self.line_starts[self.stop]]
+
+    def iter_runs(self):
+        """ Yields a (line_type, view) pair for each run of consecutive lines of the same type """
+        start = self.start
+        for type_code, run in groupby(self.types[self.start:self.stop]):
+            stop = start + sum(1 for _ in run)
+            yield self.type_names[type_code], self[start - self.start:stop - self.start]
+            start = stop
+
+    def _absolute_index(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('CAM line index out of range')
+        return self.start + index
 
 
 class CamGcodeSegment:
@@ -29,14 +159,12 @@ class CamGcodeSegment:
             self.set_z_height()
 
     def get_min_z_height(self):
-        op_height = min(
-            [line.layer_height for line in self.lines])
+        op_height = min(self.lines.get_z_heights())
         return op_height
 
     def get_max_z_height(self):
         # Filter out retracts, only care about max Z height of cutting ops
-        op_height = max(
-            [line.layer_height for line in self.lines])
+        op_height = max(self.lines.get_z_heights())
         return op_height
 
     def set_z_height(self, threshold=0.05):
@@ -63,6 +191,8 @@ class CamGcodeLayer:
         self.planar = None
         self.cutting_height = cutting_height
         self.gcode = None
+        self.pre_gcode = ''     # added before and after the layer without copying `gcode`, e.g. retracts
+        self.post_gcode = ''
 
         if self.segments:
             self.set_cutting_height()
@@ -73,17 +203,21 @@ class CamGcodeLayer:
 
     def parse_gcode(self):
         """ Combines the gcode lines from all the operations into a single string """
-        gcode = ''
+        gcode = []
         last_line_type = None
 
+        # every line in a segment has the same type
         for segment in self.segments:
-            for line in segment.lines:
-                if line.type != last_line_type:
-                    gcode += '; ' + str(line.type) + '\n'
-                    last_line_type = line.type
-                gcode += line.gcode + '\n'
+            if segment.type != last_line_type:
+                gcode.append('; ' + str(segment.type) + '\n')
+                last_line_type = segment.type
+            gcode.append(segment.lines.get_gcode())
+
+        return ''.join(gcode)
 
-        return gcode
+    def get_gcode_chunks(self):
+        """ Returns the complete gcode of the layer as a list of strings """
+        return [self.pre_gcode, self.gcode, self.post_gcode]
 
     def set_cutting_height(self):
         self.cutting_height = max(
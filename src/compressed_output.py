@@ -0,0 +1,122 @@
+import queue
+import threading
+import zlib
+
+
+# file extension added to the output for each compression
+EXTENSIONS = {'gzip': '.gz', 'xz': '.xz', 'zstd': '.zst'}
+
+
+def get_compressor(compression, level=None):
+    """ Returns a streaming compressor with `compress` & `flush` methods """
+    if compression == 'gzip':
+        return zlib.compressobj(6 if level is None else level, zlib.DEFLATED, 31)    # wbits 31 writes a gzip header
+    if compression == 'xz':
+        import lzma
+        return lzma.LZMACompressor(preset=6 if level is None else level)
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError('zstd compression requires the zstandard package') from None
+        return zstandard.ZstdCompressor(level=3 if level is None else level).compressobj()
+    raise ValueError('Unknown compression {!r}, expected one of {}'.format(compression, list(EXTENSIONS)))
+
+
+def open_compressed(file_path):
+    """ Opens a file for reading as bytes, decompressing it if it has one of the EXTENSIONS """
+    if file_path.endswith(EXTENSIONS['gzip']):
+        import gzip
+        return gzip.open(file_path, 'rb')
+    if file_path.endswith(EXTENSIONS['xz']):
+        import lzma
+        return lzma.open(file_path, 'rb')
+    if file_path.endswith(EXTENSIONS['zstd']):
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError('zstd compression requires the zstandard package') from None
+        return zstandard.open(file_path, 'rb')
+    return open(file_path, 'rb')
+
+
+class CompressedWriter:
+    """
+    Text file-like object that compresses what is written to it on a background thread.
+    Text is encoded into blocks of `block_size` bytes on the calling thread, while the previous blocks are compressed
+    and written, so compression overlaps with generating the gcode. At most `queue_size` blocks are waiting at once.
+    `tell` is the position in the uncompressed text, e.g. for a layer index.
+    """
+
+    def __init__(self, file_path, compression, level=None, block_size=1 << 20, queue_size=8):
+        self.compressor = get_compressor(compression, level)
+        self.block_size = block_size
+        self.blocks = queue.Queue(maxsize=queue_size)
+        self.buffer = []
+        self.buffer_size = 0
+        self.position = 0
+        self.error = None
+        self.closed = False
+
+        self.file = open(file_path, 'wb')
+        self.thread = threading.Thread(target=self.compress_blocks, daemon=True)
+        self.thread.start()
+
+    def compress_blocks(self):
+        try:
+            while True:
+                block = self.blocks.get()
+                if block is None:
+                    break
+                self.file.write(self.compressor.compress(block))
+            self.file.write(self.compressor.flush())
+        except Exception as e:
+            self.error = e
+            while self.blocks.get() is not None:   # unblock the writing thread, it raises the error
+                pass
+        finally:
+            self.file.close()
+
+    def write(self, text):
+        data = text.encode('utf-8')
+        self.buffer.append(data)
+        self.buffer_size += len(data)
+        self.position += len(data)
+        if self.buffer_size >= self.block_size:
+            self.put_block()
+        return len(text)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def tell(self):
+        return self.position
+
+    def put_block(self):
+        if self.error is not None:
+            raise self.error
+        self.blocks.put(b''.join(self.buffer))
+        self.buffer = []
+        self.buffer_size = 0
+
+    def close(self):
+        """ Writes the remaining text and waits for the compression to finish """
+        if self.closed:
+            return
+        self.closed = True
+
+        try:
+            if self.buffer:
+                self.put_block()
+        finally:
+            self.blocks.put(None)
+            self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
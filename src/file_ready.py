@@ -0,0 +1,76 @@
+import os
+import time
+
+
+def wait_for_files(paths, timeout=10, settle_time=0.2, interval=0.01, max_interval=0.25,
+                   on_wait=None, clock=time.monotonic, sleep=time.sleep):
+    """
+    Waits until every file in `paths` has been completely written.
+    A file is complete once it exists, can be opened, and its size & modified time have not changed for `settle_time`
+    seconds. The files are checked with an exponential backoff from `interval` to `max_interval` seconds, `on_wait` is
+    called between checks, e.g. `adsk.doEvents` to keep Fusion responsive.
+    Raises TimeoutError if the files are not complete within `timeout` seconds.
+    """
+    start = clock()
+    last_stats = {}
+    changed_at = {}
+    waiting = list(paths)
+    while True:
+        now = clock()
+        for path in list(waiting):
+            stat = file_stat(path)
+            if stat is None:
+                continue
+            if last_stats.get(path) != stat:
+                last_stats[path] = stat
+                changed_at[path] = now
+                continue
+            if now - changed_at[path] >= settle_time and can_open(path):
+                waiting.remove(path)
+
+        if not waiting:
+            return
+
+        if now - start > timeout:
+            missing = [path for path in waiting if path not in last_stats]
+            if missing:
+                raise TimeoutError('Timed out waiting for {} to be created'.format(', '.join(missing)))
+            raise TimeoutError('Timed out waiting for {} to be written'.format(', '.join(waiting)))
+
+        if on_wait is not None:
+            on_wait()
+        sleep(interval)
+        interval = min(interval * 2, max_interval)
+
+
+def wait_for_removal(path, timeout=10, interval=0.01, max_interval=0.25, clock=time.monotonic, sleep=time.sleep):
+    """ Removes a file if it exists and waits until it is gone, raises TimeoutError if it still exists after `timeout` """
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        return
+
+    start = clock()
+    while os.path.exists(path):
+        if clock() - start > timeout:
+            raise TimeoutError('Timed out waiting for {} to be removed'.format(path))
+        sleep(interval)
+        interval = min(interval * 2, max_interval)
+
+
+def file_stat(path):
+    """ Returns the size & modified time of a file, or None if it doesn't exist """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def can_open(path):
+    """ False while another process has the file locked, e.g. Fusion 360 on Windows while posting """
+    try:
+        with open(path, 'rb'):
+            return True
+    except PermissionError:
+        return False
@@ -1,21 +1,28 @@
 from pathlib import Path
+from functools import partial
 import adsk.core
 import adsk.fusion
 import traceback
-import time
 import os
 import sys
 import subprocess
 
 from ..ASMBL_parser import Parser
+from ..parse_cache import ParseCache
 from .. import utils
+from ..file_ready import wait_for_files, wait_for_removal
+from ..toolpath_progress import ToolpathPoller
+from ..merge_worker import MergeWorker, MergeError
 
 # Global list to keep all event handlers in scope.
 # This is only needed with Python.
 handlers = []
 
+# Parser of the last merge, reused so only the gcode that changed since is parsed again
+last_parser = None
 
-def generateAllTootpaths(ui, cam):
+
+def generateAllTootpaths(ui, cam, pollInterval=0.125):
     # Check CAM data exists.
     if not cam:
         ui.messageBox('No CAM data exists in the active document.')
@@ -31,46 +38,43 @@ def generateAllTootpaths(ui, cam):
     message = '<br>Please do not press OK until the Additive toolpath has finished.</br>\
         <br>The toolpaths for all cam operations in the document have been generated.</br>'
 
-    numOps = future.numberOfOperations
-
     #  create and show the progress dialog while the toolpaths are being generated.
     progress = ui.createProgressDialog()
     progress.isCancelButtonShown = False
     progress.show('Toolpath Generation Progress', 'Generating Toolpaths', 0, 10)
 
-    # Enter a loop to wait while the toolpaths are being generated and update
-    # the progress dialog.
-    while not future.isGenerationCompleted:
-        # since toolpaths are calculated in parallel, loop the progress bar while the toolpaths
-        # are being generated but none are yet complete.
-        n = 0
-        start = time.time()
-        while future.numberOfCompleted == 0:
-            if time.time() - start > .125:  # increment the progess value every .125 seconds.
-                start = time.time()
-                n += 1
-                progress.progressValue = n
-                adsk.doEvents()
-            if n > 10:
-                n = 0
-
-        # The first toolpath has finished computing so now display better
-        # information in the progress dialog.
-
-        # set the progress bar value to the number of completed toolpaths
-        progress.progressValue = future.numberOfCompleted
-
-        # set the progress bar max to the number of operations to be completed.
-        progress.maximumValue = numOps
-
-        # set the message for the progress dialog to track the progress value and the total number of operations to be completed.
-        progress.message = 'Generating %v of %m' + ' Toolpaths'
-        adsk.doEvents()
+    # wait while the toolpaths are being generated and update the progress dialog.
+    ToolpathPoller(future, progress, pollInterval, do_events=adsk.doEvents).run()
 
     progress.hide()
     ui.messageBox(message)
 
 
+def release_last_parser():
+    """ Drops the parser of the last merge, along with the gcode & layers it keeps in memory """
+    global last_parser
+    last_parser = None
+
+
+def merge_gcode(config, outputFolder, progress):
+    """ Merges the gcode files of `config` into `outputFolder`, run on a MergeWorker thread """
+    global last_parser
+    if last_parser is not None and last_parser.config['InputFiles'] == config['InputFiles']:
+        asmbl_parser = last_parser
+        asmbl_parser.progress = progress
+        asmbl_parser.update(config)
+    else:
+        release_last_parser()   # before parsing, so the previous job isn't held in memory at the same time
+        asmbl_parser = Parser(config, progress, cache=ParseCache('~/Asmbl/cache/'))
+    last_parser = asmbl_parser
+
+    try:
+        return asmbl_parser.create_output_file(folder_path=outputFolder, open_output=False)
+    except Exception:
+        release_last_parser()   # a failed merge may have left the stages half computed
+        raise
+
+
 def get_setups(ui, cam):
     if not cam:
         ui.messageBox('No CAM data exists in the active document.')
@@ -89,12 +93,7 @@ def get_setups(ui, cam):
 
 def remove_old_file(path, file_name):
     file_path = os.path.join(path, file_name)
-    if os.path.exists(file_path):
-        os.remove(file_path)
-
-    # ensure file deleted
-    while os.path.exists(file_path):
-        pass
+    wait_for_removal(file_path)
 
 
 def postToolpaths(ui, cam, viewResult):
@@ -169,7 +168,7 @@ def postCamToolpath(ui, cam, setup, units, output_folder, part_name):
     if setup_operation_type == adsk.cam.OperationTypes.MillingOperation:
         # remove old files
         programName = part_name + '_' + setup.name
-        remove_old_file(output_folder, programName)
+        remove_old_file(output_folder, programName + '.gcode')
 
         # get post processor
         postConfig = os.path.join(Path(__file__).parents[2], 'post_processors', 'asmbl_cam.cps')
@@ -179,24 +178,12 @@ def postCamToolpath(ui, cam, setup, units, output_folder, part_name):
 
         cam.postProcess(setup, postInput)
 
-        start = time.time()
         file_path = os.path.join(output_folder, programName + '.gcode')
-        while not os.path.exists(file_path):
-            if time.time() > start + 10:
-                ui.messageBox('Posting timed out')
-                return
-            pass    # wait until files exist
-
-        checkpoint = time.time()
-        while True:
-            if time.time() > checkpoint + 10:
-                ui.messageBox('Permission Error timed out')
-                return
-            try:
-                open(file_path)
-                break
-            except PermissionError:
-                continue
+        try:
+            wait_for_files([file_path], on_wait=adsk.doEvents)
+        except TimeoutError as e:
+            ui.messageBox('Posting timed out:\n{}'.format(e))
+            return
 
 
 # Event handler that reacts when the command definitio is executed which
@@ -337,31 +324,17 @@ class PostProcessExecuteHandler(adsk.core.CommandEventHandler):
         tmpAdditive = os.path.join(outputFolder, 'tmpAdditive.gcode')
         tmpSubtractive = os.path.join(outputFolder, 'tmpSubtractive.gcode')
 
-        # remove old files
-        if os.path.exists(tmpAdditive):
-            os.remove(tmpAdditive)
-        if os.path.exists(tmpSubtractive):
-            os.remove(tmpSubtractive)
-
         try:
-            start = time.time()
+            # remove old files
+            wait_for_removal(tmpAdditive)
+            wait_for_removal(tmpSubtractive)
+
             postToolpaths(ui, cam, viewIntermediateFiles)
-            while not (os.path.exists(tmpAdditive) and os.path.exists(tmpSubtractive)):
-                if time.time() > start + 10:
-                    ui.messageBox('Posting timed out')
-                    return
-                pass    # wait until files exist
-            checkpoint = time.time()
-            while True:
-                if time.time() > checkpoint + 10:
-                    ui.messageBox('Permission Error timed out')
-                    return
-                try:
-                    open(tmpAdditive)
-                    open(tmpSubtractive)
-                    break
-                except PermissionError:
-                    continue
+            # the files are parsed as soon as Fusion has finished writing them
+            wait_for_files([tmpAdditive, tmpSubtractive], on_wait=adsk.doEvents)
+        except TimeoutError as e:
+            ui.messageBox('Posting timed out:\n{}'.format(e))
+            return
         except:
             ui.messageBox('Failed posting toolpaths:\n{}'.format(traceback.format_exc()))
             return
@@ -389,13 +362,19 @@ class PostProcessExecuteHandler(adsk.core.CommandEventHandler):
         # ui.messageBox(config.__str__())
 
         try:
-            time.sleep(1)   # be sure files are written completely
-            asmbl_parser = Parser(config, progress)
-
             outputFolder = os.path.expanduser('~/Asmbl/output/')
-            asmbl_parser.create_output_file(asmbl_parser.merged_gcode_script, outputFolder)
 
+            # merge on a worker thread so Fusion stays responsive, progress is passed back to this thread
+            worker = MergeWorker(partial(merge_gcode, config, outputFolder), progress.progressValue)
+            worker.start()
+            outputFile = worker.wait(progress, on_wait=adsk.doEvents)
+
+            # desktop applications are opened from this thread
+            utils.open_file(outputFile)
             utils.open_file(outputFolder)
+        except MergeError as e:
+            ui.messageBox('Failed combing gcode files:\n{}'.format(e))
+            return
         except:
             ui.messageBox('Failed combing gcode files:\n{}'.format(traceback.format_exc()))
             return
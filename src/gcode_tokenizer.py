@@ -0,0 +1,54 @@
+from collections import namedtuple
+
+
+# Compact record of a single line of gcode, any word that is not present is None
+# i & j are the arc centre offsets of G2/G3 moves
+GcodeLine = namedtuple('GcodeLine', ['command', 'x', 'y', 'z', 'e', 'f', 'i', 'j', 'text'])
+
+AXES = 'XYZEFIJ'
+AXIS_INDEX = {axis: index for index, axis in enumerate(AXES)}
+
+
+def tokenize(text):
+    """
+    Parses a line of gcode into a GcodeLine in a single pass.
+    Only the first occurrence of each word is used, anything after a ';' comment is ignored.
+    """
+    command, _, parameters = text.partition(';')[0].partition(' ')
+
+    values = [None] * len(AXES)
+    for word in parameters.split(' '):
+        index = AXIS_INDEX.get(word[:1])
+        if index is None or values[index] is not None:
+            continue
+        try:
+            values[index] = float(word[1:])
+        except ValueError:
+            pass    # not a number, e.g. text in a message
+
+    return GcodeLine(command, *values, text)
+
+
+def offset_line(line, offset):
+    """ Returns a new GcodeLine with the X, Y & Z words moved by `offset` """
+    x = line.x + offset[0] if line.x is not None else None
+    y = line.y + offset[1] if line.y is not None else None
+    z = line.z + offset[2] if line.z is not None else None
+
+    return line._replace(x=x, y=y, z=z, text=replace_xyz(line.text, x, y, z))
+
+
+def replace_xyz(text, x, y, z):
+    """ Rewrites the X, Y & Z words of a line of gcode with new values, a value of None leaves the word as is """
+    values = {'X': x, 'Y': y, 'Z': z}
+
+    command, space, parameters = text.partition(' ')
+    parameters, semicolon, comment = parameters.partition(';')
+
+    words = parameters.split(' ')
+    for i, word in enumerate(words):
+        value = values.get(word[:1])
+        if value is not None:
+            words[i] = word[0] + str(value)
+
+    return command + space + ' '.join(words) + semicolon + comment
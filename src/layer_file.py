@@ -0,0 +1,132 @@
+import json
+import struct
+import zlib
+from collections import namedtuple
+
+from .utils import json_height
+
+
+# Layout: header, one length prefixed block of (optionally compressed) gcode per merged layer, then the index.
+# The header holds the offset of the index, so a layer can be read with one seek once the index is loaded.
+MAGIC = b'ASMBLLF1'
+HEADER = struct.Struct('<8sBQ')     # magic, compression, index offset
+BLOCK_LENGTH = struct.Struct('<I')
+
+COMPRESSIONS = ['none', 'zlib', 'zstd']
+
+# `kind` is the layer class name, e.g. 'AdditiveGcodeLayer', `offset` is the file position of the block & `size`
+# is the length of its uncompressed utf-8 gcode. `layer_height` is None for the end of the additive file
+LayerRecord = namedtuple('LayerRecord', ['name', 'kind', 'layer_height', 'tool', 'offset', 'length', 'size'])
+
+
+def get_codec(compression, level=None):
+    """ Returns (compress, decompress) functions for a compression in COMPRESSIONS """
+    if compression == 'none':
+        return bytes, bytes
+    if compression == 'zlib':
+        level = 6 if level is None else level
+        return (lambda data: zlib.compress(data, level)), zlib.decompress
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError('zstd compression requires the zstandard package') from None
+        compressor = zstandard.ZstdCompressor(level=3 if level is None else level)
+        return compressor.compress, zstandard.ZstdDecompressor().decompress
+    raise ValueError('Unknown compression {!r}, expected one of {}'.format(compression, COMPRESSIONS))
+
+
+class LayerFileWriter:
+    """ Writes merged layers to a binary layer file, use as a context manager or call `close` to write the index """
+
+    def __init__(self, file_path, compression='zlib', level=None):
+        self.compression = compression
+        self.compress, _ = get_codec(compression, level)
+        self.records = []
+
+        self.file = open(file_path, 'wb')
+        self.file.write(HEADER.pack(MAGIC, COMPRESSIONS.index(compression), 0))
+
+    def write_layer(self, gcode, name=None, kind=None, layer_height=None, tool=None):
+        data = gcode.encode('utf-8')
+        block = self.compress(data)
+
+        offset = self.file.tell()
+        self.file.write(BLOCK_LENGTH.pack(len(block)))
+        self.file.write(block)
+        self.records.append(LayerRecord(name, kind, json_height(layer_height), tool, offset, len(block), len(data)))
+
+    def close(self):
+        if self.file.closed:
+            return
+
+        index = zlib.compress(json.dumps([list(record) for record in self.records]).encode('utf-8'))
+        index_offset = self.file.tell()
+        self.file.write(BLOCK_LENGTH.pack(len(index)))
+        self.file.write(index)
+
+        self.file.seek(0)
+        self.file.write(HEADER.pack(MAGIC, COMPRESSIONS.index(self.compression), index_offset))
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if exc[0] is None:
+            self.close()
+        else:
+            # without the index the header keeps index_offset 0, so readers know the file is incomplete
+            self.file.close()
+
+
+class LayerFileReader:
+    """ Reads the layers of a binary layer file, any layer can be read without reading the ones before it """
+
+    def __init__(self, file_path):
+        self.file = open(file_path, 'rb')
+
+        magic, compression, index_offset = HEADER.unpack(self.file.read(HEADER.size))
+        if magic != MAGIC:
+            self.file.close()
+            raise ValueError('{} is not an ASMBL layer file'.format(file_path))
+        if index_offset == 0:
+            self.file.close()
+            raise ValueError('{} is incomplete, the index was never written'.format(file_path))
+
+        self.compression = COMPRESSIONS[compression]
+        _, self.decompress = get_codec(self.compression)
+
+        self.file.seek(index_offset)
+        index = self.read_block()
+        self.records = [LayerRecord(*record) for record in json.loads(zlib.decompress(index).decode('utf-8'))]
+
+    def read_block(self):
+        length, = BLOCK_LENGTH.unpack(self.file.read(BLOCK_LENGTH.size))
+        return self.file.read(length)
+
+    def read_layer(self, i):
+        """ Returns the gcode of layer `i`, negative indices count from the end """
+        self.file.seek(self.records[i].offset)
+        return self.decompress(self.read_block()).decode('utf-8')
+
+    def iter_layers(self, start=0):
+        """ Lazily yields the gcode of each layer from layer `start`, e.g. to stream to a printer """
+        for i in range(start, len(self.records)):
+            yield self.read_layer(i)
+
+    def read_gcode(self):
+        """ The whole merged gcode script """
+        return ''.join(self.iter_layers())
+
+    def __len__(self):
+        return len(self.records)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,96 @@
+import json
+import os
+from bisect import bisect_left
+
+from .compressed_output import EXTENSIONS, open_compressed
+
+
+INDEX_SUFFIX = '.index.json'
+INDEX_VERSION = 1
+
+
+def get_index_path(gcode_path):
+    return gcode_path + INDEX_SUFFIX
+
+
+def write_index(gcode_path, records):
+    """
+    Saves the layer index sidecar of a gcode file. Each record is a dict of the layer's name, kind (the layer class,
+    or 'header' for the script header), layer_height (None for the end of the additive file), tool, and the byte
+    offset & length of its gcode in the file
+    """
+    index = {
+        'version': INDEX_VERSION,
+        'gcode': os.path.basename(gcode_path),
+        'layers': records,
+    }
+    with open(get_index_path(gcode_path), 'w') as f:
+        json.dump(index, f, indent=1)
+
+
+def read_index(gcode_path):
+    """ Returns the layer records of a gcode file's index sidecar """
+    with open(get_index_path(gcode_path), 'r') as f:
+        index = json.load(f)
+
+    if index.get('version') != INDEX_VERSION:
+        raise ValueError('Unsupported layer index version {!r}'.format(index.get('version')))
+    return index['layers']
+
+
+class IndexedGcodeReader:
+    """
+    Reads the merged gcode a layer at a time using its index sidecar, without scanning the file.
+    Compressed output is decompressed as it is read, the offsets are positions in the uncompressed gcode. Seeking
+    back in a compressed file decompresses it again from the start, so read those layers in order where possible
+    """
+
+    def __init__(self, gcode_path, encoding='utf-8'):
+        self.gcode_path = gcode_path
+        self.records = read_index(gcode_path)
+        self.encoding = encoding
+        self.file = open_compressed(gcode_path)
+        # the zstandard stream reader can only seek forwards, so it is reopened to seek back
+        self.reopen_to_seek_back = gcode_path.endswith(EXTENSIONS['zstd'])
+
+    def seek_layer(self, i):
+        """ Moves the file to the start of layer `i` and returns the binary file, e.g. to resume streaming from it """
+        offset = self.records[i]['offset']
+        if self.reopen_to_seek_back and offset < self.file.tell():
+            self.file.close()
+            self.file = open_compressed(self.gcode_path)
+        self.file.seek(offset)
+        return self.file
+
+    def read_layer(self, i):
+        """ Returns the gcode of layer `i`, negative indices count from the end """
+        return self.seek_layer(i).read(self.records[i]['length']).decode(self.encoding)
+
+    def iter_layers(self, start=0):
+        """ Lazily yields the gcode of each layer from layer `start` """
+        for i in range(start, len(self.records)):
+            yield self.read_layer(i)
+
+    def find_layer(self, layer_height):
+        """
+        Returns the index of the first additive layer at or above `layer_height`, e.g. to resume a print from a height.
+        Raises ValueError if there is none
+        """
+        layers = [(record['layer_height'], i) for i, record in enumerate(self.records)
+                  if record['kind'] == 'AdditiveGcodeLayer' and record['layer_height'] is not None]
+        position = bisect_left(layers, (layer_height, -1))
+        if position == len(layers):
+            raise ValueError('No additive layer at or above {}'.format(layer_height))
+        return layers[position][1]
+
+    def __len__(self):
+        return len(self.records)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,61 @@
+import mmap
+import os
+
+
+class MappedGcodeFile:
+    """
+    Read only memory map of a gcode file.
+    Boundaries are found by scanning the mapped bytes, the text between them is only decoded when it is read,
+    so files larger than the available memory can be split.
+    """
+
+    def __init__(self, path, encoding='utf-8'):
+        self.path = path
+        self.encoding = encoding
+        self.file = open(path, 'rb')
+
+        if os.fstat(self.file.fileno()).st_size > 0:
+            self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.buffer = b''   # empty files can't be mapped
+
+        # match the universal newlines of a text mode file
+        first_newline = self.buffer.find(b'\n')
+        self.newline = b'\r\n' if first_newline > 0 and self.buffer[first_newline - 1:first_newline] == b'\r' else b'\n'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+        self.file.close()
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def split(self, separator):
+        """ Returns the (start, stop) byte range of each of the pieces of `text.split(separator)` """
+        separator = separator.encode(self.encoding).replace(b'\n', self.newline)
+
+        ranges = []
+        start = 0
+        while True:
+            index = self.buffer.find(separator, start)
+            if index < 0:
+                break
+            ranges.append((start, index))
+            start = index + len(separator)
+        ranges.append((start, len(self.buffer)))
+
+        return ranges
+
+    def read(self, start=0, stop=None):
+        """ Decodes the text between 2 byte offsets """
+        text = self.buffer[start:stop].decode(self.encoding)
+        if self.newline == b'\r\n':
+            text = text.replace('\r\n', '\n')
+        return text
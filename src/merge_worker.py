@@ -0,0 +1,79 @@
+import queue
+import threading
+import traceback
+
+
+class QueueProgress:
+    """
+    Stand-in for a Fusion 360 progress dialog that is safe to update from a worker thread.
+    Each update is put on `updates` for the UI thread to apply to the real dialog, see `MergeWorker.wait`
+    """
+
+    def __init__(self, updates, progressValue=0):
+        self.updates = updates
+        self._message = ''
+        self._progressValue = progressValue
+
+    @property
+    def message(self):
+        return self._message
+
+    @message.setter
+    def message(self, message):
+        self._message = message
+        self.updates.put(('message', message))
+
+    @property
+    def progressValue(self):
+        return self._progressValue
+
+    @progressValue.setter
+    def progressValue(self, value):
+        self._progressValue = value
+        self.updates.put(('progressValue', value))
+
+
+class MergeWorker(threading.Thread):
+    """
+    Runs `target(progress)` on a worker thread, e.g. parsing & merging the gcode, so the UI thread stays responsive.
+    Progress updates and the result or error are sent back through a thread-safe queue.
+    """
+
+    def __init__(self, target, progressValue=0):
+        super().__init__(daemon=True)
+        self.target = target
+        self.updates = queue.Queue()
+        self.progress = QueueProgress(self.updates, progressValue)
+
+    def run(self):
+        try:
+            result = self.target(self.progress)
+        except Exception as e:
+            self.updates.put(('error', (e, traceback.format_exc())))
+        else:
+            self.updates.put(('done', result))
+
+    def wait(self, progress=None, on_wait=None, interval=0.05):
+        """
+        Applies the progress updates to `progress` until the target has finished, calling `on_wait` between checks,
+        e.g. `adsk.doEvents`. Returns the result of the target, or raises MergeError if it failed.
+        """
+        while True:
+            try:
+                kind, value = self.updates.get(timeout=interval)
+            except queue.Empty:
+                if on_wait is not None:
+                    on_wait()
+                continue
+
+            if kind == 'done':
+                return value
+            if kind == 'error':
+                error, worker_traceback = value
+                raise MergeError(worker_traceback) from error
+            if progress is not None:
+                setattr(progress, kind, value)
+
+
+class MergeError(Exception):
+    """ An error raised by the target of a MergeWorker, the message is the traceback from the worker thread """
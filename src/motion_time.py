@@ -0,0 +1,142 @@
+from array import array
+from math import atan2, hypot, pi, sqrt
+
+from .gcode_tokenizer import tokenize
+
+
+MOTION_COMMANDS = {'G0': True, 'G00': True, 'G1': False, 'G01': False}    # command: is a rapid move
+ARC_COMMANDS = {'G2': True, 'G02': True, 'G3': False, 'G03': False}      # command: is clockwise
+
+# Default limits, mm/s² for accelerations and mm/min for feedrates like the gcode
+DEFAULT_LIMITS = {
+    'acceleration': 1000,           # G1 & G2/G3 moves
+    'rapid_acceleration': 2000,     # G0 moves
+    'rapid_feedrate': 6000,         # G0 moves don't have a feedrate
+    'max_feedrate': 12000,          # G1 feedrates are capped at this
+    'default_feedrate': 1800,       # G1 moves before the first F word
+    'tool_change_time': 0,          # seconds per T command
+}
+
+
+def arc_length(start, end, i, j, clockwise):
+    """
+    Length of a G2/G3 arc in the XY plane from `start` to `end` (x, y, z) with the centre offset `i`, `j` from the
+    start, a change in Z makes it a helix. The same start & end is a full circle
+    """
+    centre_x = start[0] + i
+    centre_y = start[1] + j
+    start_angle = atan2(start[1] - centre_y, start[0] - centre_x)
+    end_angle = atan2(end[1] - centre_y, end[0] - centre_x)
+
+    sweep = start_angle - end_angle if clockwise else end_angle - start_angle
+    if sweep <= 0:
+        sweep += 2 * pi
+
+    return hypot(hypot(i, j) * sweep, end[2] - start[2])
+
+
+def motion_columns(lines, state=None):
+    """
+    Parses the G0/G1/G2/G3 moves of lines of absolute XYZ gcode into columns, returns
+    (rapid, x, y, z, e, f, arc, tool changes). `rapid`, the end positions, relative extrusion, feedrate & arc length
+    of each move are arrays, the arc length is 0 for straight moves. The positions & feedrate carry over from the
+    previous move when a word is missing. The first move starts from `state`, see `estimate_time`
+    Arcs must use I & J centre offsets, an arc without them is timed as a straight move
+    """
+    state = state if state is not None else {}
+    last_x, last_y, last_z = state.get('position', (0.0, 0.0, 0.0))
+    last_f = state.get('feedrate')
+
+    rapid = array('b')
+    x, y, z, e, f, arc = array('d'), array('d'), array('d'), array('d'), array('d'), array('d')
+    tool_changes = 0
+    for line in lines:
+        first = line[:1]
+        if first == 'T':
+            tool_changes += 1
+            continue
+        if first != 'G':
+            continue
+
+        tokens = tokenize(line)
+        is_rapid = MOTION_COMMANDS.get(tokens.command)
+        clockwise = None
+        if is_rapid is None:
+            clockwise = ARC_COMMANDS.get(tokens.command)
+            if clockwise is None:
+                continue
+            is_rapid = False
+
+        start = last_x, last_y, last_z
+        if tokens.x is not None:
+            last_x = tokens.x
+        if tokens.y is not None:
+            last_y = tokens.y
+        if tokens.z is not None:
+            last_z = tokens.z
+        if tokens.f is not None:
+            last_f = tokens.f
+
+        length = 0.0
+        if clockwise is not None and (tokens.i or tokens.j):
+            length = arc_length(start, (last_x, last_y, last_z), tokens.i or 0.0, tokens.j or 0.0, clockwise)
+
+        rapid.append(is_rapid)
+        x.append(last_x)
+        y.append(last_y)
+        z.append(last_z)
+        e.append(tokens.e or 0.0)
+        f.append(last_f or 0.0)    # 0 means not set yet
+        arc.append(length)
+
+    state['position'] = last_x, last_y, last_z
+    state['feedrate'] = last_f
+
+    return rapid, x, y, z, e, f, arc, tool_changes
+
+
+def estimate_move_times(columns, start, limits):
+    """
+    Returns the time in seconds of each move of `motion_columns`, starting from the `start` position.
+    Each move accelerates from & decelerates to a stop, with a trapezoidal velocity profile, or a triangular one if
+    the move is too short to reach its feedrate. This doesn't look ahead across corners, so it is an upper bound.
+    The deltas are mapped over the columns with builtins, the distances & times are list comprehensions over the moves.
+    """
+    rapid, x, y, z, e, f, arc, _ = columns
+    if not rapid:
+        return []
+
+    x0, y0, z0 = start
+    dx = map(float.__sub__, x, [x0] + x[:-1].tolist())
+    dy = map(float.__sub__, y, [y0] + y[:-1].tolist())
+    dz = map(float.__sub__, z, [z0] + z[:-1].tolist())
+    # arcs are timed by their length, extrude only moves, e.g. retracts, by the length of filament
+    distances = [length or d or abs(de) for d, de, length in zip(map(hypot, dx, dy, dz), e, arc)]
+
+    rapid_speed = limits['rapid_feedrate'] / 60
+    max_feedrate = limits['max_feedrate']
+    default_feedrate = limits['default_feedrate']
+    speeds = [rapid_speed if is_rapid else min(feedrate or default_feedrate, max_feedrate) / 60
+              for is_rapid, feedrate in zip(rapid, f)]
+
+    acceleration = limits['acceleration']
+    rapid_acceleration = limits['rapid_acceleration']
+    accelerations = [rapid_acceleration if is_rapid else acceleration for is_rapid in rapid]
+
+    return [d / v + v / a if d * a >= v * v else 2 * sqrt(d / a)
+            for d, v, a in zip(distances, speeds, accelerations)]
+
+
+def estimate_time(lines, state=None, limits=None):
+    """
+    Returns the estimated seconds to run lines of gcode, see `estimate_move_times`
+    `state` carries the position & feedrate between calls, so a script can be estimated in pieces, e.g. per layer
+    """
+    limits = dict(DEFAULT_LIMITS, **(limits or {}))
+    state = state if state is not None else {}
+
+    start = state.get('position', (0.0, 0.0, 0.0))
+    columns = motion_columns(lines, state)
+    tool_changes = columns[-1]
+
+    return sum(estimate_move_times(columns, start, limits)) + tool_changes * limits['tool_change_time']
@@ -0,0 +1,104 @@
+import hashlib
+import os
+import pickle
+import tempfile
+import zlib
+
+
+# Bump when the parsed classes or the parsing change, so old cache entries are never loaded
+PARSER_VERSION = '1'
+
+
+class ParseCache:
+    """
+    On disk cache of parsed gcode, keyed by a hash of the input gcode and the parser version.
+    Entries are pickled & zlib compressed, the least recently used entries are removed once the
+    cache is larger than `max_size` bytes.
+    """
+
+    def __init__(self, folder, max_size=500 * 1024 * 1024):
+        self.folder = os.path.expanduser(folder)
+        self.max_size = max_size
+        os.makedirs(self.folder, exist_ok=True)
+
+    def get_key(self, gcode_hash, *settings):
+        """ Key from the hash of the gcode text (see `utils.hash_gcode`), the parser version and any settings that change the parsed result """
+        digest = hashlib.sha256(PARSER_VERSION.encode())
+        for setting in settings:
+            digest.update(repr(setting).encode())
+        digest.update(gcode_hash.encode())
+
+        return digest.hexdigest()
+
+    def get_path(self, key):
+        return os.path.join(self.folder, key + '.cache')
+
+    def load(self, key):
+        """ Returns the cached object, or None if it isn't cached """
+        path = self.get_path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+
+        try:
+            cached = pickle.loads(zlib.decompress(data))
+        except Exception:
+            # corrupt or from an incompatible version
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            return None
+
+        try:
+            os.utime(path)  # mark as recently used
+        except FileNotFoundError:
+            pass
+        return cached
+
+    def store(self, key, value):
+        """
+        Saves `value` to the cache, returns False if it could not be saved.
+        A failed store only means the next load is a miss, so the error is printed instead of raised
+        """
+        path = self.get_path(key)
+        # each store writes its own temporary file, so processes storing the same key don't write to the same file
+        tmp_fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=self.folder)
+        try:
+            with os.fdopen(tmp_fd, 'wb') as f:
+                f.write(zlib.compress(pickle.dumps(value, pickle.HIGHEST_PROTOCOL), 1))
+            os.replace(tmp_path, path)
+        except Exception as error:
+            print('Could not save to the parse cache: {}'.format(error))
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            return False
+
+        self.evict()
+        return True
+
+    def evict(self):
+        """ Removes the least recently used entries until the cache is within `max_size` """
+        # other processes may be using the same cache, so entries can be removed at any point
+        entries = []
+        for entry in os.scandir(self.folder):
+            if entry.is_file() and entry.name.endswith('.cache'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
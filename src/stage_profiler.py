@@ -0,0 +1,84 @@
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+class StageProfiler:
+    """
+    Records the wall time, CPU time, lines processed and peak traced memory of each Parser stage.
+    Stages run the stages they depend on, so the times of a stage exclude the stages it ran,
+    the peak memory includes them.
+    """
+
+    def __init__(self, trace_memory=False, callback=None):
+        self.trace_memory = trace_memory    # tracemalloc slows down allocation heavy stages
+        self.callback = callback            # called with the stage name & record when each stage finishes
+        self.stages = {}
+        self.running = []
+
+        # memory is traced from here on, so the peak of a stage includes what the earlier stages kept
+        self.started_tracing = trace_memory and not tracemalloc.is_tracing()
+        if self.started_tracing:
+            tracemalloc.start()
+
+    def stop(self):
+        """ Stops tracing memory if it was started by this profiler """
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+
+    @contextmanager
+    def measure(self, name):
+        """ Records the code run in the context as stage `name`, yields the record """
+        record = {'wall_time': 0.0, 'cpu_time': 0.0, 'lines': None, 'peak_memory': None}
+        if self.trace_memory:
+            self.save_peak()
+            tracemalloc.reset_peak()
+            record['peak_memory'] = 0
+
+        self.running.append(record)
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield record
+        finally:
+            wall_time = time.perf_counter() - wall_start
+            cpu_time = time.process_time() - cpu_start
+            record['wall_time'] += wall_time
+            record['cpu_time'] += cpu_time
+            self.running.pop()
+
+            if self.trace_memory:
+                self.save_peak(record)
+                tracemalloc.reset_peak()
+
+            if self.running:
+                parent = self.running[-1]
+                parent['wall_time'] -= wall_time
+                parent['cpu_time'] -= cpu_time
+                if self.trace_memory:
+                    parent['peak_memory'] = max(parent['peak_memory'], record['peak_memory'])
+
+            self.stages[name] = record
+            if self.callback is not None:
+                self.callback(name, record)
+
+    def save_peak(self, record=None):
+        """ Keeps the peak traced memory since the last reset in `record`, or the running stage """
+        if record is None:
+            if not self.running:
+                return
+            record = self.running[-1]
+        record['peak_memory'] = max(record['peak_memory'], tracemalloc.get_traced_memory()[1])
+
+    def add_lines(self, count):
+        """ Adds to the lines processed by the running stage """
+        if self.running:
+            record = self.running[-1]
+            record['lines'] = (record['lines'] or 0) + count
+
+    def write_report(self, file_path):
+        """ Saves the stage records as JSON """
+        with open(file_path, 'w') as f:
+            json.dump(self.stages, f, indent=4)
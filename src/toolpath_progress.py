@@ -0,0 +1,38 @@
+import time
+
+
+class ToolpathPoller:
+    """
+    Updates a progress dialog while Fusion 360 generates toolpaths, checking the GenerateToolpathFuture every
+    `interval` seconds and sleeping in between so the toolpath generation gets the CPU.
+    Only the attributes of the future & progress dialog that are used here are needed, so it can be run with fakes.
+    """
+
+    def __init__(self, future, progress, interval=0.125, do_events=None, sleep=time.sleep):
+        self.future = future
+        self.progress = progress
+        self.interval = interval
+        self.do_events = do_events  # e.g. `adsk.doEvents`, keeps the Fusion UI responsive between checks
+        self.sleep = sleep
+        self.polls = 0
+
+    def run(self):
+        """ Returns once all the toolpaths have been generated """
+        while not self.future.isGenerationCompleted:
+            self.poll()
+            if self.do_events is not None:
+                self.do_events()
+            self.sleep(self.interval)
+
+    def poll(self):
+        """ Updates the progress dialog from the future """
+        self.polls += 1
+        completed = self.future.numberOfCompleted
+        if completed == 0:
+            # toolpaths are calculated in parallel, so loop the progress bar until the first one is complete
+            self.progress.progressValue = self.polls % 11
+            return
+
+        self.progress.maximumValue = self.future.numberOfOperations
+        self.progress.progressValue = completed
+        self.progress.message = 'Generating %v of %m Toolpaths'
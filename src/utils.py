@@ -1,24 +1,59 @@
 import sys
 import os
-import subprocess
-import time
+import hashlib
+from math import inf
 
+from .gcode_tokenizer import (
+    tokenize,
+    offset_line,
+)
 
-def convert_relative(gcode_abs):
-    """ Converts absolute extrusion gcode into relative extrusion gcode """
-    absolute_mode = False
-    last_tool = None
-    last_e = {}     # {'tool': last extrusion value}
 
-    lines = gcode_abs.split('\n')
+def convert_relative(gcode_abs, state=None):
+    """
+    Converts absolute extrusion gcode into relative extrusion gcode
+    See `iter_relative` for converting a file in pieces with `state`
+    """
+    lines = list(iter_relative(gcode_abs.split('\n'), state))
+    if not lines:
+        return ''
+
+    return '\n'.join(lines) + '\n'
+
 
-    gcode_rel = ''
+def iter_relative(lines, state=None):
+    """
+    Lazily converts lines of absolute extrusion gcode into relative extrusion gcode
+
+    Yields the converted lines without a trailing newline, empty lines are dropped
+    Passing the same `state` dict to consecutive calls continues the conversion where the last call
+    finished, so a file can be converted in pieces.
+    """
+    if state is None:
+        state = {}
+    absolute_mode = state.get('absolute_mode', False)
+    last_tool = state.get('last_tool')
+    last_e = state.setdefault('last_e', {})     # {'tool': last extrusion value}
 
     for line in lines:
         if line == '':
             continue
 
-        line_start = line.split(' ')[0]
+        line_start = line.partition(' ')[0]
+        # Convert Extrusion coordinates to relative if in absolute mode
+        # Moves are nearly every line, so only the E word is replaced, the rest of the line and any comment are kept
+        if absolute_mode and (line_start == 'G1' or line_start == 'G0'):
+            code, semicolon, comment = line.partition(';')
+            position, e_word, words = code.partition(' E')
+            if e_word:
+                extrusion, space, words = words.partition(' ')
+                extrusion = float(extrusion)
+                extrusion_diff = round(extrusion - last_e[last_tool], 3)
+                last_e[last_tool] = extrusion
+                line = position + ' E' + str(extrusion_diff) + space + words + semicolon + comment
+            yield line
+            continue
+
         # Check for absolute extrusion
         if line_start == ('M82'):
             absolute_mode = True
@@ -29,53 +64,59 @@ def convert_relative(gcode_abs):
             absolute_mode = False
 
         # Check for tool change
-        elif line_start[0] == 'T':
+        elif line_start.startswith('T'):
             last_tool = line_start
 
         # Check for extrusion reset
         elif line_start == 'G92':
-            extrusion_reset = line.split('E')[1]
-            last_e[last_tool] = extrusion_reset
+            extrusion = tokenize(line).e
+            if extrusion is not None:
+                last_e[last_tool] = extrusion
 
-        # Convert Extrusion coordinates to relative if in absolute mode
-        if absolute_mode:
-            if line_start == 'G0' or line_start == 'G1':
-                try:
-                    line_split = line.split('E')
-                    current_extrusion = line_split[1]
-                    extrusion_diff = float(current_extrusion) - float(last_e[last_tool])
-                    extrusion_diff = round(extrusion_diff, 3)
-                    last_e[last_tool] = current_extrusion
-                    line = line_split[0] + 'E' + str(extrusion_diff)
-                except IndexError:
-                    pass
-        gcode_rel += line + '\n'
-
-    return gcode_rel
+        yield line
 
+    state['absolute_mode'] = absolute_mode
+    state['last_tool'] = last_tool
 
-def offset_gcode(gcode, offset):
-    gcode_segments = gcode.split(' ')
-    offset_gcode = ''
-    for gcode_segment in gcode_segments:
-        if gcode_segment[0] == 'X':
-            x_pos = float(gcode_segment[1:])
-            x_pos += offset[0]
-            gcode_segment = gcode_segment[0] + str(x_pos)
 
-        elif gcode_segment[0] == 'Y':
-            y_pos = float(gcode_segment[1:])
-            y_pos += offset[1]
-            gcode_segment = gcode_segment[0] + str(y_pos)
+def iter_lines(file):
+    """ Lazily yields the lines of an open text file without their trailing newline """
+    for line in file:
+        if line.endswith('\n'):
+            line = line[:-1]
+        yield line
 
-        elif gcode_segment[0] == 'Z':
-            z_pos = float(gcode_segment[1:])
-            z_pos += offset[2]
-            gcode_segment = gcode_segment[0] + str(z_pos)
 
-        offset_gcode += ' ' + gcode_segment
+def iter_split(blocks, separator):
+    """
+    Lazily yields the same pieces as `''.join(blocks).split(separator)`
+
+    `blocks` can be any iterable of strings, such as an open file, so only the current
+    piece is ever held in memory.
+    """
+    keep = len(separator) - 1   # a separator may straddle 2 blocks
+    head = []
+    tail = ''
+    for block in blocks:
+        pieces = (tail + block).split(separator)
+        if len(pieces) > 1:
+            yield ''.join(head) + pieces[0]
+            yield from pieces[1:-1]
+            head = []
+
+        last = pieces[-1]
+        if keep:
+            head.append(last[:-keep])
+            tail = last[-keep:]
+        else:
+            head.append(last)
+
+    yield ''.join(head) + tail
 
-    return offset_gcode[1:]
+
+def offset_gcode(gcode, offset):
+    """ Moves the X, Y & Z words of a single line of gcode by `offset` """
+    return offset_line(tokenize(gcode), offset).text
 
 
 def find_maxima(numbers):
@@ -112,10 +153,52 @@ def find_maxima(numbers):
     return maxima
 
 
+def hash_gcode(gcode):
+    """ Returns the sha256 hex digest of the gcode text """
+    digest = hashlib.sha256()
+
+    block_size = 1 << 20    # avoid encoding a copy of the whole file at once
+    for i in range(0, len(gcode), block_size):
+        digest.update(gcode[i:i + block_size].encode('utf-8', 'surrogatepass'))
+
+    return digest.hexdigest()
+
+
+def has_display():
+    """ False on a headless Linux machine, where there is no desktop to open files with """
+    if sys.platform in ('win32', 'darwin'):
+        return True
+    return bool(os.environ.get('DISPLAY') or os.environ.get('WAYLAND_DISPLAY'))
+
+
 def open_file(path):
+    """ Opens a file or folder with the default desktop application, without waiting for it to close """
+    if not has_display():
+        return
+
     if sys.platform == 'win32':
         path = os.path.normpath(path)
         os.startfile(path, 'open')
     else:
+        import subprocess   # only needed on desktops, deferred to keep start up fast
         opener = 'open' if sys.platform == 'darwin' else 'xdg-open'
-        subprocess.call([opener, path])
+        subprocess.Popen([opener, path], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def map_processes(function, items, workers, chunksize=1):
+    """
+    Maps `function` over `items` in a pool of `workers` processes, the results are in the same order as `items`.
+    With 1 worker the items are mapped lazily in this process, so nothing has to be pickled.
+    `function` must be a module level function, the workers only receive its name
+    """
+    if workers <= 1:
+        return map(function, items)
+
+    from concurrent.futures import ProcessPoolExecutor    # deferred, it is slow to import and rarely used
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(function, items, chunksize=chunksize))
+
+
+def json_height(layer_height):
+    """ inf is not valid JSON, the end of the additive file is stored as None """
+    return None if layer_height == inf else layer_height
@@ -0,0 +1,20 @@
+import pytest
+
+from benchmarks.gcode_generators import synthetic_additive_gcode, synthetic_cam_gcode
+
+
+@pytest.fixture
+def config(tmp_path):
+    """ Config of small synthetic additive & CAM gcode files in a temporary folder """
+    additive_path = tmp_path / 'additive.gcode'
+    subtractive_path = tmp_path / 'subtractive.nc'
+    additive_path.write_text(synthetic_additive_gcode(20, 10))
+    subtractive_path.write_text(synthetic_cam_gcode(3, 3, 5))
+
+    return {
+        'InputFiles': {'additive_gcode': str(additive_path), 'subtractive_gcode': str(subtractive_path)},
+        'Printer': {'bed_centre_x': 10, 'bed_centre_y': 0},
+        'PrintSettings': {'raft_height': 0},
+        'CamSettings': {'layer_overlap': 1, 'layer_dropdown': 0},
+        'OutputSettings': {'filename': 'test'},
+    }
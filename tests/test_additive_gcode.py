@@ -0,0 +1,32 @@
+import pytest
+
+from benchmarks.gcode_generators import synthetic_additive_gcode
+from src.ASMBL_parser import create_additive_layers
+from src.additive_gcode import scan_layer_heights
+
+
+ODD_GCODE = '\n'.join([
+    '; initialise',
+    'G1 Z9',
+    '; layer 1, Z = 0.2',
+    'G1 X1 Y1 Z0.2',
+    'G1 X2 Z0.3 ; layer 2, Z = 0.3 in a comment',
+    'G1 X3 Z0.4',
+    'T1',
+    '; layer 3, Z = 0.5',
+    'G1 Z0.5 ; move to park position',
+    'G1 Z0.1',
+    '; layer end',
+    'G1 Z200',
+]) + '\n'
+
+
+@pytest.mark.parametrize('gcode', [synthetic_additive_gcode(30, 5), ODD_GCODE])
+def test_scan_layer_heights_matches_layers(gcode):
+    layers = create_additive_layers(gcode.split('; layer'))
+
+    assert scan_layer_heights(gcode.split('\n')) == [layer.layer_height for layer in layers]
+
+
+def test_scan_layer_heights_without_layers():
+    assert scan_layer_heights(['G1 Z1', 'G1 Z2']) == [0]
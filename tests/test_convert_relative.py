@@ -0,0 +1,44 @@
+import pytest
+
+from src.utils import convert_relative
+
+
+# (absolute gcode, expected relative gcode)
+# The first pairs were produced by the original quadratic convert_relative and must stay byte-identical
+GOLDEN = [
+    # M82 is swapped for M83 and each E value becomes the difference from the last one
+    (
+        'M82\nT0\nG92 E0\nG1 X1 Y1 E0.5\nG1 X2 Y1 E1.25\nG0 X3 Y3',
+        'M83\nT0\nG92 E0\nG1 X1 Y1 E0.5\nG1 X2 Y1 E0.75\nG0 X3 Y3\n',
+    ),
+    # Each tool keeps its own last extrusion value
+    (
+        'M82\nT0\nG92 E0\nG1 X1 E1\nT1\nG92 E0\nG1 X1 E2\nT0\nG1 X5 E2',
+        'M83\nT0\nG92 E0\nG1 X1 E1.0\nT1\nG92 E0\nG1 X1 E2.0\nT0\nG1 X5 E1.0\n',
+    ),
+    # G92 resets the last extrusion value of the current tool
+    (
+        'M82\nT0\nG92 E0\nG1 X1 E3\nG92 E0\nG1 X6 E0.1\nG92 E1.5\nG1 X7 E2',
+        'M83\nT0\nG92 E0\nG1 X1 E3.0\nG92 E0\nG1 X6 E0.1\nG92 E1.5\nG1 X7 E0.5\n',
+    ),
+    # Moves in M83 mode are left alone, M82 resumes from the last absolute value
+    (
+        'M82\nT0\nG92 E0\nG1 X1 E1\nM83\nG1 X7 E0.2\nM82\nG1 X8 E1.4',
+        'M83\nT0\nG92 E0\nG1 X1 E1.0\nM83\nG1 X7 E0.2\nM83\nG1 X8 E0.4\n',
+    ),
+    # Comments, travel moves and blank lines
+    (
+        ';LAYER:1\nM82\nT0\nG92 E0\n\nG0 F3000 X1 Y2 Z0.4\n;TYPE:WALL-OUTER\nG1 X2 E0.02',
+        ';LAYER:1\nM83\nT0\nG92 E0\nG0 F3000 X1 Y2 Z0.4\n;TYPE:WALL-OUTER\nG1 X2 E0.02\n',
+    ),
+    # Words and comments after the E word are kept
+    (
+        'M82\nT0\nG92 E0\nG1 X1 E0.5 F1800\nG1 X2 E1.25 ; wipe\nG1 X3 E1.5;x',
+        'M83\nT0\nG92 E0\nG1 X1 E0.5 F1800\nG1 X2 E0.75 ; wipe\nG1 X3 E0.25;x\n',
+    ),
+]
+
+
+@pytest.mark.parametrize('gcode_abs, gcode_rel', GOLDEN)
+def test_convert_relative_golden(gcode_abs, gcode_rel):
+    assert convert_relative(gcode_abs) == gcode_rel
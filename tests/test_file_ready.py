@@ -0,0 +1,62 @@
+import threading
+import time
+
+import pytest
+
+from src.file_ready import wait_for_files
+
+
+class FakeClock:
+    """ Clock that only moves when `sleep` is called, so the timeouts don't take real time """
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def write_in_chunks(path, chunks, delay):
+    with open(path, 'w') as f:
+        for chunk in chunks:
+            f.write(chunk)
+            f.flush()
+            time.sleep(delay)
+
+
+def test_wait_for_files_waits_until_written(tmp_path):
+    path = tmp_path / 'cam.nc'
+    chunks = ['G1 X{} Y0 Z0\n'.format(i) for i in range(10)]
+    writer = threading.Thread(target=write_in_chunks, args=(path, chunks, 0.02))
+    writer.start()
+
+    try:
+        wait_for_files([str(path)], timeout=5, settle_time=0.1)
+        assert path.read_text() == ''.join(chunks)
+    finally:
+        writer.join()
+
+
+def test_wait_for_files_times_out_if_not_created(tmp_path):
+    clock = FakeClock()
+    path = str(tmp_path / 'missing.nc')
+
+    with pytest.raises(TimeoutError, match='to be created'):
+        wait_for_files([path], timeout=1, clock=clock, sleep=clock.sleep)
+    assert clock.now > 1
+
+
+def test_wait_for_files_times_out_if_still_written(tmp_path):
+    clock = FakeClock()
+    path = tmp_path / 'cam.nc'
+    path.write_text('G1 X0\n')
+
+    def append():
+        with open(path, 'a') as f:
+            f.write('G1 X1\n')
+
+    with pytest.raises(TimeoutError, match='to be written'):
+        wait_for_files([str(path)], timeout=1, on_wait=append, clock=clock, sleep=clock.sleep)
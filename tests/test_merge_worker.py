@@ -0,0 +1,57 @@
+import threading
+
+import pytest
+
+from src.merge_worker import MergeError, MergeWorker
+
+
+class FakeProgress:
+    def __init__(self):
+        self.message = ''
+        self.progressValue = 0
+
+
+def test_wait_forwards_progress_and_returns_result():
+    def target(progress):
+        for step in range(1, 4):
+            progress.message = 'step {}'.format(step)
+            progress.progressValue = step
+        return 'merged'
+
+    worker = MergeWorker(target)
+    worker.start()
+    progress = FakeProgress()
+
+    assert worker.wait(progress) == 'merged'
+    assert progress.message == 'step 3'
+    assert progress.progressValue == 3
+
+
+def test_wait_calls_on_wait_while_target_runs():
+    release = threading.Event()
+    waits = []
+
+    def on_wait():
+        waits.append(1)
+        release.set()
+
+    worker = MergeWorker(lambda progress: release.wait(5))
+    worker.start()
+
+    assert worker.wait(on_wait=on_wait, interval=0.01) is True
+    assert waits
+
+
+def test_wait_raises_merge_error_with_worker_traceback():
+    def target(progress):
+        progress.progressValue = 1
+        raise ValueError('bad gcode')
+
+    worker = MergeWorker(target)
+    worker.start()
+    progress = FakeProgress()
+
+    with pytest.raises(MergeError, match='ValueError: bad gcode') as error_info:
+        worker.wait(progress)
+    assert isinstance(error_info.value.__cause__, ValueError)
+    assert progress.progressValue == 1
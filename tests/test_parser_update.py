@@ -0,0 +1,65 @@
+import copy
+import os
+
+import pytest
+
+from src.ASMBL_parser import Parser
+
+
+def merged(parser):
+    return ''.join(parser.emit())
+
+
+@pytest.mark.parametrize('stage', ['load', 'convert', 'split_additive', 'split_subtractive', 'order'])
+def test_update_after_partial_stage(config, stage):
+    parser = Parser(config)
+    getattr(parser, stage)()
+
+    parser.update()
+
+    assert merged(parser) == merged(Parser(config))
+
+
+def test_update_reuses_subtractive_layers_with_same_offset(config):
+    parser = Parser(config)
+    merged(parser)
+    operations = parser.stages['split_subtractive']
+
+    changed = copy.deepcopy(config)
+    changed['CamSettings']['layer_overlap'] = 2
+    parser.update(changed)
+
+    assert merged(parser) == merged(Parser(changed))
+    assert parser.stages['split_subtractive'] is operations
+
+
+def test_update_parses_subtractive_again_when_offset_changes(config):
+    parser = Parser(config)
+    merged(parser)
+    operations = parser.stages['split_subtractive']
+
+    changed = copy.deepcopy(config)
+    changed['CamSettings']['layer_dropdown'] = 0.2
+    parser.update(changed)
+
+    assert merged(parser) == merged(Parser(changed))
+    assert parser.stages['split_subtractive'] is not operations
+
+
+def test_update_reuses_layers_of_a_resaved_input(config):
+    parser = Parser(config)
+    merged(parser)
+    additive_layers = parser.stages['split_additive']
+    operations = parser.stages['split_subtractive']
+
+    path = config['InputFiles']['subtractive_gcode']
+    with open(path, 'r') as f:
+        gcode = f.read()
+    with open(path, 'w') as f:
+        f.write(gcode)
+    os.utime(path, (1, 1))  # the modified time always changes, so the gcode is compared
+    parser.update()
+
+    assert parser.stages['split_additive'] is additive_layers
+    assert parser.stages['split_subtractive'] is operations
+    assert parser.input_hashes == {}    # only hashed for the cache keys
@@ -0,0 +1,62 @@
+from src.toolpath_progress import ToolpathPoller
+
+
+class FakeFuture:
+    """ Stand-in for a GenerateToolpathFuture, one more toolpath is completed each time it is checked """
+
+    def __init__(self, operations, checks_before_first):
+        self.numberOfOperations = operations
+        self.checks = 0
+        self.checks_before_first = checks_before_first
+
+    @property
+    def numberOfCompleted(self):
+        return max(0, self.checks - self.checks_before_first)
+
+    @property
+    def isGenerationCompleted(self):
+        self.checks += 1
+        return self.numberOfCompleted >= self.numberOfOperations
+
+
+class FakeProgress:
+    def __init__(self):
+        self.progressValue = 0
+        self.maximumValue = 0
+        self.message = ''
+        self.values = []
+
+    def __setattr__(self, name, value):
+        if name == 'progressValue' and 'values' in self.__dict__:
+            self.values.append(value)
+        super().__setattr__(name, value)
+
+
+def test_run_updates_progress_until_complete():
+    future = FakeFuture(operations=3, checks_before_first=2)
+    progress = FakeProgress()
+    sleeps = []
+    events = []
+
+    poller = ToolpathPoller(future, progress, interval=0.5, do_events=lambda: events.append(1), sleep=sleeps.append)
+    poller.run()
+
+    assert future.numberOfCompleted == 3
+    # loops while nothing is complete, then counts the completed toolpaths
+    assert progress.values == [1, 2, 1, 2]
+    assert progress.maximumValue == 3
+    assert progress.message == 'Generating %v of %m Toolpaths'
+    assert sleeps == [0.5] * poller.polls
+    assert len(events) == poller.polls
+
+
+def test_run_returns_without_polling_if_already_complete():
+    future = FakeFuture(operations=0, checks_before_first=0)
+    progress = FakeProgress()
+    sleeps = []
+
+    poller = ToolpathPoller(future, progress, sleep=sleeps.append)
+    poller.run()
+
+    assert poller.polls == 0
+    assert sleeps == []